@@ -30,6 +30,63 @@
         return null;
     }
 
+    function getMetadataPath(card) {
+        const modelPath = getModelPath(card);
+        if (!modelPath) return null;
+        let metadataPath = modelPath.replace(/\.[^/.]+$/, '.metadata.json').replace(/\\/g, '/');
+        if (!metadataPath.startsWith('models/')) metadataPath = 'models/' + metadataPath;
+        return metadataPath;
+    }
+
+    // Summaries of many metadata files in one request, {path: {field: value} or null}
+    async function fetchMetadataSummaries(paths, fields) {
+        const resp = await fetch('/sd-webui-model-downloader/api/metadata/batch', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ paths, fields })
+        });
+        if (!resp.ok) throw new Error("Metadata request failed");
+        return (await resp.json()).results || {};
+    }
+
+    // Cards waiting for their title, collected so every visible card is fetched in one round-trip
+    let pendingTitleCards = [];
+    let titleFetchTimeout = null;
+
+    function queueTitleFetch(card) {
+        pendingTitleCards.push(card);
+        if (titleFetchTimeout) clearTimeout(titleFetchTimeout);
+        titleFetchTimeout = setTimeout(flushTitleFetch, 50);
+    }
+
+    async function flushTitleFetch() {
+        titleFetchTimeout = null;
+        const cards = pendingTitleCards;
+        pendingTitleCards = [];
+        const byPath = {};
+        cards.forEach(card => {
+            const metadataPath = getMetadataPath(card);
+            if (!metadataPath) return;
+            (byPath[metadataPath] = byPath[metadataPath] || []).push(card);
+        });
+        const paths = Object.keys(byPath);
+        if (!paths.length) return;
+        try {
+            const results = await fetchMetadataSummaries(paths, ['id', 'name']);
+            paths.forEach(path => {
+                const summary = results[path];
+                if (!summary) return;
+                byPath[path].forEach(card => {
+                    if (summary.id) card.dataset.civitaiModelId = summary.id;
+                    if (!summary.name) return;
+                    // span.name is the confirmed title element in Forge/A1111
+                    const titleEl = card.querySelector('span.name');
+                    if (titleEl) titleEl.textContent = summary.name;
+                });
+            });
+        } catch (e) { /* ignore */ }
+    }
+
     function notifySDWebUI(message, type = "info") {
         const app = gradioApp();
         const alertBox = app.querySelector('#js_alert_box input, #js_alert_box textarea');
@@ -63,26 +120,20 @@
                 urlBtn.onclick = async function (e) {
                     e.stopPropagation();
                     e.preventDefault();
-                    let modelPath = getModelPath(card);
-                    if (!modelPath) {
+                    const metadataPath = getMetadataPath(card);
+                    if (!metadataPath) {
                         notifySDWebUI("Could not determine model path for info page.", "error");
                         return;
                     }
-                    let metadataPath = modelPath.replace(/\.[^/.]+$/, '.metadata.json').replace(/\\/g, '/');
-                    if (!metadataPath.startsWith('models/')) metadataPath = 'models/' + metadataPath;
                     const domain = (typeof opts !== 'undefined' && opts.civitai_preferred_domain)
                         ? opts.civitai_preferred_domain : 'civitai.com';
                     try {
-                        let resp = await fetch(`/sd-webui-model-downloader/api/metadata?path=${encodeURIComponent(metadataPath)}`);
-                        if (!resp.ok) throw new Error("Metadata not found");
-                        let metadata = await resp.json();
-                        let modelId = null;
-                        if (metadata.civitai && metadata.civitai.modelId) {
-                            modelId = metadata.civitai.modelId;
-                        } else if (metadata.civitai && metadata.civitai.id) {
-                            modelId = metadata.civitai.id;
-                        } else if (metadata.id) {
-                            modelId = metadata.id;
+                        // Cards with a title already know their model id from the batch request
+                        let modelId = card.dataset.civitaiModelId;
+                        if (!modelId) {
+                            const summary = (await fetchMetadataSummaries([metadataPath], ['id']))[metadataPath];
+                            if (!summary) throw new Error("Metadata not found");
+                            modelId = summary.id;
                         }
                         if (!modelId) throw new Error("No model id in metadata");
                         window.open(`https://${domain}/models/${modelId}/`, "_blank");
@@ -127,22 +178,7 @@
         // Title replacement: run every time so it applies even if opts weren't ready on first pass
         if (typeof opts !== 'undefined' && opts.civitai_show_model_title_on_card && !card.dataset.civitaiTitleSet) {
             card.dataset.civitaiTitleSet = '1';
-            (async () => {
-                const modelPath = getModelPath(card);
-                if (!modelPath) return;
-                let metadataPath = modelPath.replace(/\.[^/.]+$/, '.metadata.json').replace(/\\/g, '/');
-                if (!metadataPath.startsWith('models/')) metadataPath = 'models/' + metadataPath;
-                try {
-                    const resp = await fetch(`/sd-webui-model-downloader/api/metadata?path=${encodeURIComponent(metadataPath)}`);
-                    if (!resp.ok) return;
-                    const metadata = await resp.json();
-                    const modelName = metadata && metadata.name ? metadata.name : null;
-                    if (!modelName) return;
-                    // span.name is the confirmed title element in Forge/A1111
-                    const titleEl = card.querySelector('span.name');
-                    if (titleEl) titleEl.textContent = modelName;
-                } catch (e) { /* ignore */ }
-            })();
+            queueTitleFetch(card);
         }
     }
 
@@ -0,0 +1,161 @@
+from fastapi import APIRouter, Request, HTTPException
+from .utils import parse_civitai_model_and_version_id
+from .download_queue import download_queue
+from .scan_jobs import scan_runner, SCAN_TYPES
+from .results import CATEGORIES, RESULTS_PAGE_SIZE
+
+# Headless access to the downloader, for scripts that provision models without a browser.
+# Everything goes through the same download queue and scans as the UI.
+
+router = APIRouter()
+
+API_PREFIX = '/sd-webui-model-downloader/api'
+# Most downloads one request may enqueue
+MAX_DOWNLOADS_PER_REQUEST = 1000
+
+
+def enqueue_download(item):
+    """
+    Queue one download from {"url": ...} or {"model_id": ..., "version_id": ...}, with an
+    optional "preview_url". Returns the job, or raises ValueError if no model id is given.
+    """
+    if isinstance(item, (str, int)):
+        item = {"url": str(item)}
+    if not isinstance(item, dict):
+        raise ValueError(f"Not a download: {item!r}")
+    model_id = item.get('model_id')
+    version_id = item.get('version_id') or item.get('model_version_id')
+    if not model_id and item.get('url'):
+        model_id, parsed_version_id = parse_civitai_model_and_version_id(str(item['url']))
+        version_id = version_id or parsed_version_id
+    if not model_id or not str(model_id).isdigit():
+        raise ValueError(f"Could not parse model ID from: {item.get('url') or item.get('model_id')}")
+    if version_id and not str(version_id).isdigit():
+        raise ValueError(f"Invalid version ID: {version_id}")
+    return download_queue.add(model_id, version_id, item.get('preview_url'))
+
+
+def get_download_job(job_id):
+    job = download_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No download job #{job_id}")
+    return job
+
+
+def get_scan_job(scan_id):
+    scan = scan_runner.get(scan_id)
+    if scan is None:
+        raise HTTPException(status_code=404, detail=f"No scan #{scan_id}")
+    return scan
+
+
+@router.post(API_PREFIX + '/downloads')
+async def add_downloads(request: Request):
+    """
+    Queue downloads. Body: one download ({"url": ...} or {"model_id": ..., "version_id": ...})
+    or {"downloads": [...]} with many. Returns {"jobs": [...], "errors": [...]}; a model that is
+    already downloading returns its running job.
+    """
+    data = await request.json()
+    items = data.get('downloads') if isinstance(data, dict) and 'downloads' in data else [data]
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="downloads must be a list")
+    if len(items) > MAX_DOWNLOADS_PER_REQUEST:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_DOWNLOADS_PER_REQUEST} downloads per request")
+    jobs, errors = [], []
+    for item in items:
+        try:
+            jobs.append(enqueue_download(item).to_dict())
+        except ValueError as e:
+            errors.append(str(e))
+    if not jobs and errors:
+        raise HTTPException(status_code=400, detail=errors[0] if len(errors) == 1 else errors)
+    return {"jobs": jobs, "errors": errors}
+
+
+@router.get(API_PREFIX + '/downloads')
+async def list_downloads(active: bool = False):
+    jobs = [job for job in list(download_queue.jobs) if not active or job.is_active()]
+    return {"jobs": [job.to_dict() for job in jobs]}
+
+
+@router.get(API_PREFIX + '/downloads/{job_id}')
+async def get_download(job_id: int):
+    return get_download_job(job_id).to_dict()
+
+
+@router.post(API_PREFIX + '/downloads/{job_id}/{action}')
+async def download_action(job_id: int, action: str):
+    """Cancel, pause or resume a download job."""
+    handlers = {
+        "cancel": download_queue.cancel,
+        "pause": download_queue.pause,
+        "resume": download_queue.resume,
+    }
+    if action not in handlers:
+        raise HTTPException(status_code=404, detail=f"Unknown action: {action}")
+    job = get_download_job(job_id)
+    if not handlers[action](job_id):
+        raise HTTPException(status_code=409, detail=f"Can't {action} job #{job_id} while it is {job.state}")
+    return job.to_dict()
+
+
+@router.post(API_PREFIX + '/scans/{scan_type}')
+async def start_scan(scan_type: str):
+    """Start a missing-info ("missing_info") or update ("updates") check in the background."""
+    if scan_type not in SCAN_TYPES:
+        raise HTTPException(status_code=404, detail=f"Unknown scan type: {scan_type}")
+    try:
+        return scan_runner.start(scan_type).to_dict()
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@router.get(API_PREFIX + '/scans')
+async def list_scans():
+    return {"jobs": [scan.to_dict() for scan in scan_runner.list()]}
+
+
+@router.get(API_PREFIX + '/scans/{scan_id:int}')
+async def get_scan(scan_id: int):
+    return get_scan_job(scan_id).to_dict()
+
+
+@router.get(API_PREFIX + '/scans/{scan_id:int}/results')
+async def get_scan_results(scan_id: int, category: str = None, query: str = "", page: int = 1,
+                           page_size: int = RESULTS_PAGE_SIZE):
+    """One page of a scan's results, optionally of one category (fixed, skipped, failed, updates) or matching `query`."""
+    results = get_scan_job(scan_id).job.results
+    if category and category not in CATEGORIES:
+        raise HTTPException(status_code=400, detail=f"category must be one of {', '.join(CATEGORIES)}")
+    if results is None:
+        return {"results": [], "total": 0, "page": 1, "pages": 1}
+    page_size = min(max(1, page_size), 1000)
+    rows, total, pages = results.page(category, query, page, page_size)
+    return {
+        "results": [{"category": c, "file": f, "message": m} for c, f, m in rows],
+        "total": total,
+        "page": min(max(1, page), pages),
+        "pages": pages,
+    }
+
+
+@router.post(API_PREFIX + '/scans/{scan_id:int}/cancel')
+async def cancel_scan(scan_id: int):
+    scan = get_scan_job(scan_id)
+    if not scan_runner.cancel(scan_id):
+        raise HTTPException(status_code=409, detail=f"Scan #{scan_id} is already {scan.state}")
+    return scan.to_dict()
+
+
+@router.get(API_PREFIX + '/jobs')
+async def list_jobs():
+    """Every download and scan of this session with its progress, most recent last."""
+    return {
+        "downloads": [job.to_dict() for job in list(download_queue.jobs)],
+        "scans": [scan.to_dict() for scan in scan_runner.list()],
+    }
+
+
+def on_app_started(demo, app):
+    app.include_router(router)
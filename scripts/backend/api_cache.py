@@ -0,0 +1,155 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from . import http_client
+from .utils import get_extension_data_path, get_api_cache_ttl
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    fetched REAL NOT NULL,
+    body TEXT NOT NULL
+);
+"""
+
+# Entries not refreshed for this long are dropped by prune()
+MAX_AGE_SECONDS = 30 * 24 * 3600
+# ...and the oldest ones beyond this many bytes of response bodies
+MAX_CACHE_BYTES = 200 * 1024 * 1024
+
+
+class CachedResponse:
+    """The parts of a requests.Response callers use, for a body served from the cache."""
+
+    status_code = 200
+
+    def __init__(self, body, revalidated=False):
+        self.text = body
+        self.revalidated = revalidated
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        pass
+
+
+def cache_key(url, params=None, headers=None):
+    """Key of a request: its URL and parameters, and which API key it was made with."""
+    auth = (headers or {}).get("Authorization", "")
+    raw = json.dumps([url, sorted((params or {}).items()), hashlib.sha256(auth.encode()).hexdigest()[:16]])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class ApiCache:
+    """
+    On-disk cache of Civitai API responses. A response younger than the TTL is served without
+    asking the server; an older one is revalidated with If-None-Match / If-Modified-Since, so an
+    unchanged model costs a 304 instead of the whole payload.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def _load(self, key):
+        with self._lock:
+            return self._connection().execute("SELECT * FROM responses WHERE key = ?", (key,)).fetchone()
+
+    def _save(self, key, url, etag, last_modified, body):
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, url, etag, last_modified, fetched, body) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, url, etag, last_modified, time.time(), body),
+            )
+            conn.commit()
+
+    def _touch(self, key):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("UPDATE responses SET fetched = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+
+    def get(self, url, params=None, headers=None, ttl=None, **kwargs):
+        """
+        GET `url` like http_client.get, served from the cache when possible. Only 200 responses
+        are cached; anything else is returned as the server sent it.
+        """
+        ttl = get_api_cache_ttl() if ttl is None else ttl
+        key = cache_key(url, params, headers)
+        try:
+            entry = self._load(key)
+        except sqlite3.Error as e:
+            print(f"API cache unavailable: {e}")
+            return http_client.get(url, params=params, headers=headers, **kwargs)
+        if entry is not None and time.time() - entry["fetched"] < ttl:
+            return CachedResponse(entry["body"])
+        request_headers = dict(headers or {})
+        if entry is not None:
+            if entry["etag"]:
+                request_headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                request_headers["If-Modified-Since"] = entry["last_modified"]
+        resp = http_client.get(url, params=params, headers=request_headers, **kwargs)
+        try:
+            if resp.status_code == 304 and entry is not None:
+                self._touch(key)
+                return CachedResponse(entry["body"], revalidated=True)
+            if resp.status_code == 200:
+                self._save(key, url, resp.headers.get("ETag"), resp.headers.get("Last-Modified"), resp.text)
+        except sqlite3.Error as e:
+            print(f"Failed to update the API cache: {e}")
+        return resp
+
+    def prune(self, max_age=MAX_AGE_SECONDS, max_bytes=MAX_CACHE_BYTES):
+        """Drop entries older than `max_age`, then the oldest beyond `max_bytes`. Returns how many were removed."""
+        with self._lock:
+            conn = self._connection()
+            removed = conn.execute("DELETE FROM responses WHERE fetched < ?", (time.time() - max_age,)).rowcount
+            removed += conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM (SELECT key, SUM(LENGTH(body)) OVER (ORDER BY fetched DESC) AS size FROM responses)"
+                " WHERE size > ?)",
+                (max_bytes,),
+            ).rowcount
+            conn.commit()
+        return removed
+
+    def clear(self):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM responses")
+            conn.commit()
+
+
+api_cache = ApiCache(get_extension_data_path("api_cache.sqlite3"))
+
+
+def prune_api_cache():
+    try:
+        removed = api_cache.prune()
+    except sqlite3.Error as e:
+        print(f"Failed to prune the API cache: {e}")
+        return
+    if removed:
+        print(f"Removed {removed} old responses from the Civitai API cache")
+
+
+def on_app_started(demo, app):
+    # In the background, a big cache shouldn't hold up the WebUI start
+    threading.Thread(target=prune_api_cache, daemon=True).start()
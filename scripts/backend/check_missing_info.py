@@ -1,128 +1,206 @@
 import os
-import hashlib
-import requests
-from .utils import get_model_folders, get_civitai_api_key, get_civitai_domains, save_preview_and_metadata
-from .process_control import is_running, set_running, clear_running, cancel_process, is_cancelled, get_type
-
-def sha256_of_file(filepath):
-    h = hashlib.sha256()
-    with open(filepath, 'rb') as f:
-        for chunk in iter(lambda: f.read(8192), b''):
-            h.update(chunk)
-    return h.hexdigest()
-
-def get_model_info_by_hash(file_hash, api_key=None):
+import time
+from . import http_client
+from .api_cache import api_cache
+from .rate_limiter import rate_limiter
+from .utils import get_civitai_api_key, get_civitai_domains, save_preview_and_metadata, get_low_io_priority
+from .hashing import HashCancelled, HashProgress, hash_file, get_hash_workers, lookup_known_hashes
+from .hash_index import hash_index
+from .pipeline import Pipeline, Stage
+from . import webui_hashes
+from .library_watcher import get_library
+from .results import ResultSink, FIXED, SKIPPED, FAILED
+
+# Threads for the Civitai lookups and for downloading previews and writing metadata
+LOOKUP_WORKERS = 2
+SAVE_WORKERS = 2
+# Hashes per bulk by-hash request
+BULK_LOOKUP_SIZE = 100
+# Files per batch when looking up already known hashes, the scan reports progress in between
+KNOWN_HASH_BATCH = 500
+
+
+def fetch_model_info_by_hash(domain, file_hash, headers):
+    """The model version of one hash on one domain, None if the domain doesn't know it."""
+    resp = api_cache.get(f"https://{domain}/api/v1/model-versions/by-hash/{file_hash}", headers=headers)
+    if resp.status_code == 404:
+        return None
+    resp.raise_for_status()
+    return resp.json()
+
+def version_sha256s(model_version_info):
+    """Lowercase SHA256 hashes of every file of a model version."""
+    hashes = set()
+    for file_info in model_version_info.get('files') or []:
+        file_hash = (file_info.get('hashes') or {}).get('SHA256')
+        if file_hash:
+            hashes.add(file_hash.lower())
+    return hashes
+
+def get_model_infos_by_hashes(file_hashes, api_key=None):
+    """
+    {sha256: model version} for many hashes through the bulk by-hash endpoint, BULK_LOOKUP_SIZE
+    hashes per request. A hash is looked up on its own only on the domains whose bulk request
+    for it failed, and only if no other bulk request answered for it.
+    """
     headers = {}
     if api_key:
         headers["Authorization"] = f"Bearer {api_key}"
-    last_exc = None
+    remaining = {file_hash.lower() for file_hash in file_hashes}
+    found = {}
+    # Hashes some bulk request answered for, found or not
+    answered = set()
+    # Domains whose bulk request failed, per hash, in the order they were tried
+    failed_on = {}
     for domain in get_civitai_domains():
-        try:
-            resp = requests.get(f"https://{domain}/api/v1/model-versions/by-hash/{file_hash}", headers=headers)
-            if resp.status_code == 404:
-                continue
-            resp.raise_for_status()
-            return resp.json()
-        except Exception as e:
-            last_exc = e
-            continue
-    return None  # Not found on any domain
-
-def cancel_check_missing_info():
-    cancel_process()
-
-def check_missing_info():
-    if is_running():
-        yield f"Another process is already running: {get_type()}"
-        return
-    set_running('missing_info')
-    try:
-        MODEL_FOLDERS = get_model_folders()
-        summary = []
-        skip_types = {"Controlnet", "Upscaler", "VAE"}
-        files_to_check = []
-        # Deduplicate folders to avoid scanning the same folder multiple times
-        unique_folders = set()
-        for model_type, folder in MODEL_FOLDERS.items():
-            if model_type in skip_types:
+        if not remaining:
+            break
+        pending = sorted(remaining)
+        for i in range(0, len(pending), BULK_LOOKUP_SIZE):
+            batch = pending[i:i + BULK_LOOKUP_SIZE]
+            try:
+                resp = http_client.post(
+                    f"https://{domain}/api/v1/model-versions/by-hash", json=batch, headers=headers,
+                )
+                resp.raise_for_status()
+                model_version_infos = resp.json()
+            except Exception as e:
+                print(f"Bulk hash lookup of {len(batch)} hashes failed on {domain}: {e}")
+                for file_hash in batch:
+                    failed_on.setdefault(file_hash, []).append(domain)
                 continue
-            abs_folder = os.path.abspath(folder)
-            if not os.path.exists(abs_folder):
+            answered.update(batch)
+            for model_version_info in model_version_infos:
+                for file_hash in version_sha256s(model_version_info) & remaining:
+                    found[file_hash] = model_version_info
+                    remaining.discard(file_hash)
+    for file_hash in sorted(remaining - answered):
+        for domain in failed_on.get(file_hash, []):
+            try:
+                model_version_info = fetch_model_info_by_hash(domain, file_hash, headers)
+            except Exception:
                 continue
-            unique_folders.add(abs_folder)
-        # First pass: build a list of files with any missing info
-        for abs_folder in unique_folders:
-            for root, dirs, files in os.walk(abs_folder):
-                for file in files:
-                    if not (file.lower().endswith(('.safetensors', '.ckpt', '.pt'))):
-                        continue
-                    base = os.path.splitext(file)[0]
-                    metadata_path = os.path.join(root, base + '.metadata.json')
-                    preview_found = False
-                    for ext in ['.jpg', '.jpeg', '.png', '.webp']:
-                        if os.path.exists(os.path.join(root, base + f'.preview{ext}')):
-                            preview_found = True
-                            break
-                    missing = []
-                    if not os.path.exists(metadata_path):
-                        missing.append('metadata')
-                    if not preview_found:
-                        missing.append('preview')
-                    if missing:
-                        files_to_check.append((root, file, missing))
-        total = len(files_to_check)
-        if total == 0:
-            yield "All models have metadata and preview."
+            if model_version_info:
+                found[file_hash] = model_version_info
+                break
+    return found
+
+def fetch_model_infos(items, api_key):
+    """Lookup stage: find the model versions of a batch of items, returns the ones with a match."""
+    found = get_model_infos_by_hashes([item['hash'] for item in items], api_key=api_key)
+    return [item for item in items if attach_model_info(item, found.get(item['hash'].lower()))]
+
+
+def attach_model_info(item, model_version_info):
+    if not model_version_info:
+        item['message'] = f"Skipped: {item['file']} ({', '.join(item['missing'])}) - No Civitai match for SHA256"
+        return False
+    # Files with the same hash share the version, give each item its own copy
+    model_version_info = dict(model_version_info)
+    # Break circular reference before saving
+    if 'model' in model_version_info:
+        del model_version_info['model']
+    model_info = model_version_info.get('model', {})
+    model_info['modelVersions'] = [model_version_info]
+    # Ensure model id is present in metadata
+    model_info['id'] = model_version_info.get('modelId')
+    item['model_info'] = model_info
+    item['model_version_info'] = model_version_info
+    return True
+
+
+def save_model_info(item):
+    """Writer stage: download the preview and write the metadata files."""
+    model_version_info = item['model_version_info']
+    preview_url = None
+    if model_version_info.get('images'):
+        preview_url = model_version_info['images'][0]['url']
+    save_preview_and_metadata(item['root'], item['file'], item['model_info'], preview_url, model_version_info)
+    item['message'] = f"Fixed: {item['file']} ({', '.join(item['missing'])})"
+
+
+def check_missing_info(job):
+    """Find and fix models without metadata or preview, stops once `job` is cancelled."""
+    # Single scan of the library (or the watcher's live index), sidecars are matched in memory
+    library = get_library()
+    files_to_check = [(entry.root, entry.filename, missing) for entry, missing in library.missing_info()]
+    total = len(files_to_check)
+    if total == 0:
+        yield "All models have metadata and preview."
+        return
+    # Look up known hashes in bulk rather than per file, still a stat or two each on a big library
+    file_paths = [os.path.join(root, file) for root, file, _ in files_to_check]
+    known_hashes = {}
+    for start in range(0, total, KNOWN_HASH_BATCH):
+        if job.is_cancelled():
+            yield f"Cancelled while looking up known hashes, after {start} of {total} files."
             return
-        # Second pass: process each file only once
-        for idx, (root, file, missing) in enumerate(files_to_check, 1):
-            if is_cancelled():
-                yield f"Cancelled after {idx-1} of {total} files."
-                return
-            processed = idx
-            status = f"[{processed}/{total}] Processing: {file} (missing: {', '.join(missing)})"
-            print(status)
-            yield '\n'.join(summary + [status])
-            try:
-                base = os.path.splitext(file)[0]
-                file_path = os.path.join(root, file)
-                hash_path = os.path.join(root, base + '.sha256')
-                # Use cached hash if available, else calculate and save
-                if os.path.exists(hash_path):
-                    with open(hash_path, 'r', encoding='utf-8') as hf:
-                        file_hash = hf.read().strip()
-                else:
-                    file_hash = sha256_of_file(file_path)
-                    with open(hash_path, 'w', encoding='utf-8') as hf:
-                        hf.write(file_hash)
-                api_key = get_civitai_api_key()
-                model_version_info = get_model_info_by_hash(file_hash, api_key=api_key)
-                if not model_version_info:
-                    msg = f"Skipped: {file} ({', '.join(missing)}) - No Civitai match for SHA256"
-                    print(msg)
-                    summary.append(msg)
-                    yield '\n'.join(summary + [f"[{processed}/{total}] ..."])
-                    continue
-                # Break circular reference before saving
-                if 'model' in model_version_info:
-                    del model_version_info['model']
-                model_info = model_version_info.get('model', {})
-                model_info['modelVersions'] = [model_version_info]
-                # Ensure model id is present in metadata
-                model_info['id'] = model_version_info.get('modelId')
-                preview_url = None
-                if model_version_info.get('images'):
-                    preview_url = model_version_info['images'][0]['url']
-                save_preview_and_metadata(root, file, model_info, preview_url, model_version_info)
-                msg = f"Fixed: {file} ({', '.join(missing)})"
-                print(msg)
-                summary.append(msg)
-                yield '\n\n'.join(summary + [f"[{processed}/{total}] ..."])
-            except Exception as e:
-                msg = f"Failed: {file} ({', '.join(missing)}) - {str(e)}"
-                print(msg)
-                summary.append(msg)
-                yield '\n\n'.join(summary + [f"[{processed}/{total}] ..."])
-        yield '\n\n'.join(summary)
+        known_hashes.update(lookup_known_hashes(file_paths[start:start + KNOWN_HASH_BATCH]))
+        yield f"Looking up known hashes: {min(start + KNOWN_HASH_BATCH, total)} of {total} files"
+    hashed = {}
+    api_key = get_civitai_api_key()
+    low_priority = get_low_io_priority()
+    to_hash = [p for p in file_paths if p not in known_hashes]
+    hash_progress = HashProgress(to_hash)
+    results = job.results = ResultSink(job.type, job.id)
+
+    def hash_stage(item):
+        file_hash = known_hashes.get(item['path'])
+        if not file_hash:
+            st = os.stat(item['path'])
+            file_hash, file_blake3 = hash_file(item['path'], on_bytes=hash_progress.add, is_cancelled=job.is_cancelled,
+                                               low_priority=low_priority)
+            hash_index.store(item['path'], file_hash, file_blake3, st=st)
+            hashed[item['path']] = file_hash
+        item['hash'] = file_hash
+        return item
+
+    def report(item, category):
+        msg = item.get('message')
+        if msg:
+            print(msg)
+            results.add(category, msg, item['file'])
+
+    def lookup_stage(items):
+        matched = fetch_model_infos(items, api_key)
+        matched_ids = {id(item) for item in matched}
+        for item in items:
+            if id(item) not in matched_ids:
+                report(item, SKIPPED)
+        return matched
+
+    def save_stage(item):
+        save_model_info(item)
+        report(item, FIXED)
+
+    def on_error(item, stage, e):
+        if isinstance(e, HashCancelled):
+            return
+        item['message'] = f"Failed: {item['file']} ({', '.join(item['missing'])}) - {str(e)}"
+        report(item, FAILED)
+
+    # Hash, look up and save concurrently: the disk keeps hashing while the network is busy
+    pipeline = Pipeline([
+        Stage("Hashing", hash_stage, get_hash_workers(to_hash)),
+        Stage("Looking up", lookup_stage, LOOKUP_WORKERS, batch_size=BULK_LOOKUP_SIZE),
+        Stage("Saving", save_stage, SAVE_WORKERS),
+    ], on_error=on_error)
+    hash_progress.started_at = time.time()
+    items = [
+        {'root': root, 'file': file, 'missing': missing, 'path': os.path.join(root, file)}
+        for root, file, missing in files_to_check
+    ]
+    try:
+        for _ in pipeline.run(items, is_cancelled=job.is_cancelled):
+            yield results.render(pipeline.status(), hash_progress.status(), rate_limiter.describe())
     finally:
-        clear_running()
+        results.close()
+    print(pipeline.status())
+    if hash_progress.bytes_done:
+        print(hash_progress.status())
+    # Share what we hashed with the WebUI so it doesn't hash the same files again
+    webui_hashes.store_many(hashed)
+    if job.is_cancelled():
+        yield results.render(f"Cancelled after {pipeline.finished} of {total} files.")
+        return
+    yield results.render()
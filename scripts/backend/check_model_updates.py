@@ -1,127 +1,170 @@
-import os
-import requests
 import json
-from .utils import get_model_folders, get_civitai_api_key, get_civitai_domains
-from .process_control import is_running, set_running, clear_running, cancel_process, is_cancelled, get_type
+from .api_cache import api_cache
+from .rate_limiter import rate_limiter
+from .utils import get_civitai_api_key, get_civitai_domains, query_civitai_domains
+from .library_watcher import get_library
+from .results import ResultSink, UPDATE, FAILED
+
+# Model ids per /api/v1/models request, the listing's page size limit
+MODELS_PER_REQUEST = 100
 
 def get_latest_model_info(model_id, api_key=None):
     headers = {}
     if api_key:
         headers["Authorization"] = f"Bearer {api_key}"
-    last_exc = None
-    got_404 = False
-    for domain in get_civitai_domains():
-        try:
-            resp = requests.get(f"https://{domain}/api/v1/models/{model_id}", headers=headers)
-            if resp.status_code == 404:
-                got_404 = True
-                continue
-            resp.raise_for_status()
-            return resp.json()
-        except Exception as e:
-            last_exc = e
-            continue
-    if got_404 and last_exc is None:
+
+    def fetch(domain):
+        resp = api_cache.get(f"https://{domain}/api/v1/models/{model_id}", headers=headers)
+        if resp.status_code == 404:
+            return None
+        resp.raise_for_status()
+        return resp.json()
+
+    model_info = query_civitai_domains(fetch)
+    if model_info is None:
         raise ValueError(f"Model {model_id} not found on Civitai (404)")
-    if last_exc:
-        raise last_exc
-    return None
+    return model_info
 
-def cancel_check_model_updates():
-    cancel_process()
+def get_models_by_ids(model_ids, api_key=None):
+    """
+    {model id: model info} for many models through the /api/v1/models listing, MODELS_PER_REQUEST
+    ids per request, following the cursor until every page is read. Ids the listing doesn't
+    return are left out.
+    """
+    headers = {}
+    if api_key:
+        headers["Authorization"] = f"Bearer {api_key}"
+    found = {}
+    model_ids = [str(model_id) for model_id in model_ids]
+    for i in range(0, len(model_ids), MODELS_PER_REQUEST):
+        batch = model_ids[i:i + MODELS_PER_REQUEST]
+        last_exc = None
+        for domain in get_civitai_domains():
+            try:
+                url = f"https://{domain}/api/v1/models"
+                params = {"ids": ','.join(batch), "limit": MODELS_PER_REQUEST, "nsfw": "true"}
+                page = {}
+                while url:
+                    resp = api_cache.get(url, params=params, headers=headers)
+                    resp.raise_for_status()
+                    data = resp.json()
+                    for model in data.get('items', []):
+                        page[str(model.get('id'))] = model
+                    # nextPage already carries the cursor and the other parameters
+                    url = (data.get('metadata') or {}).get('nextPage')
+                    params = None
+                found.update(page)
+                last_exc = None
+                break
+            except Exception as e:
+                last_exc = e
+                continue
+        if last_exc:
+            print(f"Failed to fetch models {', '.join(batch)}: {last_exc}")
+    return found
+
+def read_local_version(metadata_path):
+    """(model id, version id) a metadata file describes, either may be None."""
+    with open(metadata_path, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    # Try standard Civitai format first
+    model_id = meta.get('id')
+    current_version_id = None
+    if 'modelVersions' in meta and meta['modelVersions']:
+        mv = meta['modelVersions'][0]
+        current_version_id = mv.get('id')
+    # If not found, try Civitai Helper format
+    if (not model_id or not current_version_id) and 'civitai' in meta:
+        civ = meta['civitai']
+        model_id = civ.get('modelId')
+        current_version_id = civ.get('id')
+    return model_id, current_version_id
 
-def check_model_updates():
-    if is_running():
-        yield f"Another process is already running: {get_type()}"
+def check_model_updates(job):
+    """List models with a newer version on Civitai, stops once `job` is cancelled."""
+    # Only process files with .metadata.json
+    library = get_library()
+    files_to_check = [(entry.root, entry.filename, entry.metadata_path) for entry in library.with_metadata()]
+    total = len(files_to_check)
+    if total == 0:
+        yield "No models found to check for updates."
         return
-    set_running('updates')
+    api_key = get_civitai_api_key()
+    results = job.results = ResultSink(job.type, job.id)
     try:
-        MODEL_FOLDERS = get_model_folders()
-        skip_types = {"Controlnet", "Upscaler", "VAE"}
-        files_to_check = []
-        # Deduplicate folders to avoid scanning the same folder multiple times
-        unique_folders = set()
-        for model_type, folder in MODEL_FOLDERS.items():
-            if model_type in skip_types:
+        yield from _check_model_updates(job, results, files_to_check, api_key)
+    finally:
+        results.close()
+
+
+def _check_model_updates(job, results, files_to_check, api_key):
+    total = len(files_to_check)
+    # Read every local version first, so each model is fetched once however many files use it
+    local_versions = []
+    for idx, (_, file, metadata_path) in enumerate(files_to_check, 1):
+        if job.is_cancelled():
+            yield results.render(f"Cancelled after {idx-1} of {total} files.")
+            return
+        if idx % 100 == 1:
+            yield results.render(f"[{idx}/{total}] Reading metadata")
+        try:
+            model_id, current_version_id = read_local_version(metadata_path)
+        except Exception as e:
+            results.add(FAILED, f"Failed to check {file}: {str(e)}", file)
+            continue
+        if not model_id or not current_version_id:
+            results.add(FAILED, f"Could not determine model id or version for {file}", file)
+            continue
+        local_versions.append((file, model_id, current_version_id))
+    model_ids = list(dict.fromkeys(str(model_id) for _, model_id, _ in local_versions))
+    latest_infos = {}
+    for i in range(0, len(model_ids), MODELS_PER_REQUEST):
+        if job.is_cancelled():
+            yield results.render(f"Cancelled after fetching {i} of {len(model_ids)} models.")
+            return
+        status = f"Fetching models {i + 1}-{min(i + MODELS_PER_REQUEST, len(model_ids))} of {len(model_ids)}"
+        yield results.render(status, rate_limiter.describe())
+        latest_infos.update(get_models_by_ids(model_ids[i:i + MODELS_PER_REQUEST], api_key=api_key))
+    for file, model_id, current_version_id in local_versions:
+        try:
+            latest_info = latest_infos.get(str(model_id))
+            if isinstance(latest_info, Exception):
+                raise latest_info
+            if latest_info is None:
+                # Not in the listing (e.g. hidden from it), ask for the model itself, once
+                if job.is_cancelled():
+                    yield results.render("Cancelled.")
+                    return
+                try:
+                    latest_info = get_latest_model_info(model_id, api_key=api_key)
+                except Exception as e:
+                    latest_infos[str(model_id)] = e
+                    raise
+                latest_infos[str(model_id)] = latest_info
+            latest_versions = latest_info.get('modelVersions', [])
+            if not latest_versions:
+                results.add(FAILED, f"No versions found for model {model_id} ({file})", file)
+                yield results.render()
                 continue
-            abs_folder = os.path.abspath(folder)
-            if not os.path.exists(abs_folder):
+            latest_version = latest_versions[0]
+            latest_version_id = latest_version.get('id')
+            if str(current_version_id) == str(latest_version_id):
+                # Up to date
                 continue
-            unique_folders.add(abs_folder)
-        # Only process files with .metadata.json
-        for abs_folder in unique_folders:
-            for root, dirs, files in os.walk(abs_folder):
-                for file in files:
-                    if not (file.lower().endswith(('.safetensors', '.ckpt', '.pt'))):
-                        continue
-                    base = os.path.splitext(file)[0]
-                    metadata_path = os.path.join(root, base + '.metadata.json')
-                    if not os.path.exists(metadata_path):
-                        continue
-                    files_to_check.append((root, file, metadata_path))
-        total = len(files_to_check)
-        if total == 0:
-            yield "No models found to check for updates."
-            return
-        api_key = get_civitai_api_key()
-        updates = []
-        errors = []
-        for idx, (_, file, metadata_path) in enumerate(files_to_check, 1):
-            if is_cancelled():
-                yield '\n\n'.join(updates + errors + [f"Cancelled after {idx-1} of {total} files."])
-                return
-            base = os.path.splitext(file)[0]
-            status = f"[{idx}/{total}] Checking: {file}"
-            yield '\n\n'.join(updates + errors + [status])
-            try:
-                with open(metadata_path, 'r', encoding='utf-8') as f:
-                    meta = json.load(f)
-                # Try standard Civitai format first
-                model_id = meta.get('id')
-                current_version_id = None
-                if 'modelVersions' in meta and meta['modelVersions']:
-                    mv = meta['modelVersions'][0]
-                    current_version_id = mv.get('id')
-                # If not found, try Civitai Helper format
-                if (not model_id or not current_version_id) and 'civitai' in meta:
-                    civ = meta['civitai']
-                    model_id = civ.get('modelId')
-                    current_version_id = civ.get('id')
-                if not model_id or not current_version_id:
-                    msg = f"Could not determine model id or version for {file}"
-                    errors.append(msg)
-                    yield '\n\n'.join(updates + errors)
-                    continue
-                # Get latest model info from Civitai
-                latest_info = get_latest_model_info(model_id, api_key=api_key)
-                latest_versions = latest_info.get('modelVersions', [])
-                if not latest_versions:
-                    msg = f"No versions found for model {model_id} ({file})"
-                    errors.append(msg)
-                    yield msg
-                    continue
-                latest_version = latest_versions[0]
-                latest_version_id = latest_version.get('id')
-                if str(current_version_id) == str(latest_version_id):
-                    # Up to date
-                    continue
-                # New version available (Markdown link)
-                model_name = latest_info.get('name', f'Model {model_id}')
-                domain = get_civitai_domains()[0]
-                url = f"https://{domain}/models/{model_id}?modelVersionId={latest_version_id}"
-                update_msg = f"NEW VERSION of {model_name} available: [[Open in browser]]({url})"
-                updates.append(update_msg)
-                yield '\n\n'.join(updates + errors)
-            except Exception as e:
-                msg = f"Failed to check {file}: {str(e)}"
-                errors.append(msg)
-                yield '\n\n'.join(updates + errors)
-        # Final summary
-        if not updates and not errors:
-            yield "All models are up to date."
-        elif updates:
-            yield '\n\n'.join(updates + errors + [f"Check complete. {len(updates)} model(s) have updates available."])
-        elif errors and not updates:
-            yield '\n\n'.join(errors + [f"Check complete. No updates found. {len(errors)} error(s) occurred."])
-    finally:
-        clear_running()
+            # New version available (Markdown link)
+            model_name = latest_info.get('name', f'Model {model_id}')
+            domain = get_civitai_domains()[0]
+            url = f"https://{domain}/models/{model_id}?modelVersionId={latest_version_id}"
+            results.add(UPDATE, f"NEW VERSION of {model_name} available: [[Open in browser]]({url})", file)
+            yield results.render()
+        except Exception as e:
+            results.add(FAILED, f"Failed to check {file}: {str(e)}", file)
+            yield results.render()
+    # Final summary
+    updates, errors = results.counts[UPDATE], results.counts[FAILED]
+    if not updates and not errors:
+        yield "All models are up to date."
+    elif updates:
+        yield results.render(f"Check complete. {updates} model(s) have updates available.")
+    else:
+        yield results.render(f"Check complete. No updates found. {errors} error(s) occurred.")
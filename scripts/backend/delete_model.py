@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Request, HTTPException
 import os
 import json
+from .hash_index import hash_index
 
 router = APIRouter()
 
@@ -34,6 +35,7 @@ async def delete_model(request: Request):
 
     try:
         if os.path.exists(abs_model_path):
+            hash_index.invalidate(abs_model_path)
             os.remove(abs_model_path)
             # Delete related files
             related_exts = [
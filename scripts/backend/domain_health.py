@@ -0,0 +1,99 @@
+import time
+import threading
+from collections import deque
+
+CIVITAI_DOMAINS = ("civitai.com", "civitai.red")
+# Latencies kept per domain for the median and the hedging percentile
+LATENCY_WINDOW = 50
+MIN_SAMPLES = 5
+# Weight of the newest outcome in the rolling error rate
+ERROR_DECAY = 0.2
+# A domain with this error rate loses its place as the first choice
+MAX_ERROR_RATE = 0.5
+# ...as does one this many times slower than the other one
+SLOW_FACTOR = 3.0
+# Consecutive failures that open the circuit, and how long it stays open before the next try
+BREAKER_FAILURES = 3
+BREAKER_OPEN_SECONDS = 30.0
+# Hedging delay bounds, and the delay used until enough latencies are known
+HEDGE_PERCENTILE = 0.9
+HEDGE_MIN_DELAY = 0.25
+HEDGE_MAX_DELAY = 5.0
+HEDGE_DEFAULT_DELAY = 1.0
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class DomainStats:
+    def __init__(self):
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.error_rate = 0.0
+        self.failures = 0
+        self.open_until = 0.0
+
+    @property
+    def is_open(self):
+        return time.time() < self.open_until
+
+    def median(self):
+        return percentile(self.latencies, 0.5) if len(self.latencies) >= MIN_SAMPLES else None
+
+
+class DomainHealth:
+    """
+    Rolling latency and error rate of each Civitai domain, with a circuit breaker that takes a
+    failing domain out of rotation for a while. http_client records every request to a tracked
+    domain, and get_civitai_domains() asks for the best order.
+    """
+
+    def __init__(self, domains=CIVITAI_DOMAINS):
+        self.stats = {domain: DomainStats() for domain in domains}
+        self._lock = threading.Lock()
+
+    def record(self, domain, latency, ok):
+        stats = self.stats.get(domain)
+        if stats is None:
+            return
+        with self._lock:
+            stats.error_rate = stats.error_rate * (1 - ERROR_DECAY) + (0.0 if ok else ERROR_DECAY)
+            if ok:
+                stats.latencies.append(latency)
+                stats.failures = 0
+                stats.open_until = 0.0
+            else:
+                stats.failures += 1
+                if stats.failures >= BREAKER_FAILURES:
+                    if not stats.is_open:
+                        print(f"Civitai domain {domain} is failing, trying other domains first for {BREAKER_OPEN_SECONDS:.0f}s")
+                    stats.open_until = time.time() + BREAKER_OPEN_SECONDS
+
+    def order(self, domains):
+        """`domains` from best to worst, keeping the given order unless a domain is unhealthy or much slower."""
+        with self._lock:
+            medians = [m for m in (self.stats[d].median() for d in domains if d in self.stats) if m is not None]
+            fastest = min(medians) if medians else None
+
+            def rank(domain):
+                stats = self.stats.get(domain)
+                if stats is None:
+                    return (0, 0)
+                median = stats.median()
+                slow = fastest is not None and median is not None and median > fastest * SLOW_FACTOR
+                return (stats.is_open, stats.error_rate > MAX_ERROR_RATE or slow)
+
+            return sorted(domains, key=rank)
+
+    def hedge_delay(self, domain):
+        """How long to wait for `domain` before also asking the next one."""
+        with self._lock:
+            stats = self.stats.get(domain)
+            if stats is None or len(stats.latencies) < MIN_SAMPLES:
+                return HEDGE_DEFAULT_DELAY
+            delay = percentile(stats.latencies, HEDGE_PERCENTILE)
+        return min(HEDGE_MAX_DELAY, max(HEDGE_MIN_DELAY, delay))
+
+
+domain_health = DomainHealth()
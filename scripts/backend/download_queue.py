@@ -0,0 +1,441 @@
+import os
+import re
+import time
+import itertools
+import threading
+from urllib.parse import urlparse, urlunparse
+from .utils import (
+    get_model_folders, get_civitai_api_key, get_civitai_model_info, save_preview_and_metadata,
+    get_download_connections, get_max_concurrent_downloads, get_download_speed_limit,
+    get_job_speed_limit, get_low_io_priority,
+)
+from .downloader import Download, discard_partial, download_bandwidth
+from .hash_index import hash_index
+from . import webui_hashes
+
+QUEUED = "queued"
+RUNNING = "running"
+PAUSED = "paused"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+ACTIVE_STATES = (QUEUED, RUNNING, PAUSED)
+# States a job leaves on its own, a paused job waits for the user
+PENDING_STATES = (QUEUED, RUNNING)
+
+_job_ids = itertools.count(1)
+
+
+def sanitize_filename(filename):
+    """Keep only a-z, A-Z, 0-9, - and _ in the base name."""
+    base, ext = os.path.splitext(filename)
+    base = re.sub(r"\s+", "-", base)
+    base = re.sub(r"[^a-zA-Z0-9\-_]", "", base)
+    return base + ext
+
+
+class DownloadJob:
+    """One model version to download, along with its state and progress."""
+
+    def __init__(self, model_id, model_version_id=None, preview_url=None):
+        self.id = next(_job_ids)
+        self.model_id = str(model_id)
+        self.model_version_id = str(model_version_id) if model_version_id else None
+        # model_version_id is replaced by the resolved version once the job runs, this stays as asked
+        self.requested_version_id = self.model_version_id
+        self.preview_url = preview_url
+        self.state = QUEUED
+        self.message = "Queued"
+        self.model_name = None
+        self.model_type = None
+        self.filename = None
+        self.dest_path = None
+        self.downloaded = 0
+        self.total = 0
+        self.resumed_bytes = 0
+        self.started_at = None
+        self.cancel_requested = False
+        self.pause_requested = False
+
+    def finish(self, state, message):
+        self.state = state
+        self.message = message
+        print(f"[download #{self.id}] {message}")
+
+    def is_active(self):
+        return self.state in ACTIVE_STATES
+
+    def is_pending(self):
+        return self.state in PENDING_STATES
+
+    def speed(self):
+        """Average transfer speed in bytes/s, not counting bytes resumed from a .part file."""
+        if self.state != RUNNING or not self.started_at:
+            return 0
+        elapsed = time.time() - self.started_at
+        return (self.downloaded - self.resumed_bytes) / elapsed if elapsed > 0 else 0
+
+    def progress(self):
+        return self.downloaded / self.total if self.total else 0
+
+    def to_dict(self):
+        """The job's state for the REST API."""
+        return {
+            "id": self.id,
+            "kind": "download",
+            "state": self.state,
+            "message": self.message,
+            "model_id": self.model_id,
+            "model_version_id": self.model_version_id,
+            "model_name": self.model_name,
+            "model_type": self.model_type,
+            "filename": self.filename,
+            "path": self.dest_path,
+            "downloaded": self.downloaded,
+            "total": self.total,
+            "progress": self.progress(),
+            "speed": self.speed(),
+        }
+
+
+def print_download_progress(job):
+    """Draw the terminal progress bar for a running download."""
+    downloaded, total = job.downloaded, job.total
+    mb_downloaded = downloaded / 1024 / 1024
+    mb_total = total / 1024 / 1024 if total else 0
+    percent = (downloaded / total * 100) if total else 0
+    # Bytes resumed from a .part file don't count towards the speed
+    speed = job.speed() / 1024 / 1024
+    eta = (
+        ((total - downloaded) / (speed * 1024 * 1024))
+        if speed > 0 and total
+        else 0
+    )
+    bar_len = 30
+    filled_len = int(bar_len * downloaded // total) if total else 0
+    bar = "=" * filled_len + "-" * (bar_len - filled_len)
+    print(
+        f"\r[{bar}] {mb_downloaded:.1f}/{mb_total:.1f}MB "
+        f"({percent:.1f}%) | {speed:.2f}MB/s | ETA: {eta:.1f}s",
+        end="",
+        flush=True,
+    )
+
+
+def _select_version(data, model_version_id):
+    model_versions = data.get("modelVersions", [])
+    if model_version_id:
+        for v in model_versions:
+            if str(v.get("id")) == str(model_version_id):
+                return v
+        return None
+    return model_versions[0] if model_versions else None
+
+
+def run_download_job(job):
+    """
+    Does the actual work for `job`: resolves the model version, downloads the file and saves
+    the preview and metadata next to it. This is a generator that yields about twice a second
+    while the file is transferring, so callers can report the job's progress from their own loop.
+    The outcome ends up in job.state and job.message.
+    """
+    job.state = RUNNING
+    job.message = "Starting..."
+    api_key = get_civitai_api_key()
+
+    try:
+        data = get_civitai_model_info(job.model_id, api_key=api_key)
+    except Exception as e:
+        job.finish(FAILED, f"Error: {str(e)}")
+        return
+
+    version = _select_version(data, job.model_version_id)
+    if not version:
+        if job.model_version_id:
+            job.finish(FAILED, f"Model version ID {job.model_version_id} not found for model {job.model_id}.")
+        else:
+            job.finish(FAILED, "No versions found for this model.")
+        return
+    job.model_version_id = str(version.get("id"))
+    job.model_name = data.get("name", f"Model {job.model_id}")
+
+    model_type = data.get("type", "Checkpoint")
+    job.model_type = model_type
+    valid_extensions = {".safetensors", ".pth", ".ckpt"}
+    model_files = [
+        f for f in version["files"]
+        if any(f["name"].lower().endswith(ext) for ext in valid_extensions)
+    ]
+    if not model_files:
+        job.finish(FAILED, "No valid model file found for this version.")
+        return
+
+    file_info = model_files[0]
+    download_url = file_info["downloadUrl"]
+    filename = sanitize_filename(file_info["name"])
+    job.filename = filename
+
+    MODEL_FOLDERS = get_model_folders()
+    folder = MODEL_FOLDERS.get(model_type, os.path.join("models", "Stable-diffusion"))
+    os.makedirs(folder, exist_ok=True)
+    dest_path = os.path.join(folder, filename)
+    job.dest_path = dest_path
+
+    # Use selected preview URL if provided, otherwise fall back to first image
+    preview_url = job.preview_url
+    if not preview_url and "images" in version and version["images"]:
+        preview_url = version["images"][0]["url"]
+
+    if os.path.exists(dest_path):
+        # Still save metadata and preview if missing
+        save_preview_and_metadata(folder, filename, data, preview_url, version)
+        job.finish(DONE, f"Model already exists: {dest_path}")
+        return
+
+    headers = {}
+    if api_key:
+        headers["Authorization"] = f"Bearer {api_key}"
+
+    # Always use civitai.com for file downloads, seems civitai.red does not support downloads atm.
+    try:
+        parsed_dl = urlparse(download_url)
+        host_dl = parsed_dl.netloc or ""
+        if "civitai.red" in host_dl:
+            host_dl = host_dl.replace("civitai.red", "civitai.com")
+            download_url = urlunparse(parsed_dl._replace(netloc=host_dl))
+            print(f"Normalizing download URL to civitai.com: {download_url}")
+    except Exception:
+        pass
+
+    if job.cancel_requested or job.pause_requested:
+        job.finish(PAUSED if job.pause_requested else CANCELLED, "Paused" if job.pause_requested else "Cancelled")
+        return
+
+    dl = None
+    try:
+        download_bandwidth.set_rate(get_download_speed_limit())
+        dl = Download(download_url, dest_path, headers=headers, connections=get_download_connections(),
+                      speed_limit=get_job_speed_limit(), low_priority=get_low_io_priority())
+        dl.open()
+        job.total = dl.total
+        job.downloaded = job.resumed_bytes = dl.resumed_bytes
+
+        print(f"\nDownloading {filename} ({model_type}) from {download_url}")
+        print(f"Total size: {dl.total // 1024 // 1024}MB")
+        if dl.resumable:
+            print(f"Using {sum(1 for _, end, pos in dl.ranges if pos <= end)} connections")
+
+        job.message = "Downloading..."
+        job.started_at = time.time()
+        dl.start()
+        while dl.is_alive():
+            time.sleep(0.5)
+            if job.cancel_requested or job.pause_requested:
+                dl.cancel()
+                dl.join()
+                job.downloaded = dl.downloaded
+                if job.pause_requested and dl.resumable:
+                    job.finish(PAUSED, f"Paused: {filename}")
+                elif dl.resumable:
+                    job.finish(CANCELLED, f"Download cancelled, partial file kept for resuming: {filename}")
+                else:
+                    discard_partial(dest_path)
+                    job.finish(CANCELLED, f"Download cancelled and partial files deleted for: {filename}")
+                return
+            job.downloaded = dl.downloaded
+            # Pick up changed speed limits while downloading
+            download_bandwidth.set_rate(get_download_speed_limit())
+            dl.bandwidth.set_rate(get_job_speed_limit())
+            yield
+        job.downloaded = dl.downloaded
+        # Verify against the hash Civitai lists for the file, indexing the hash comes for free
+        dl.finish(expected_sha256=(file_info.get("hashes") or {}).get("SHA256"))
+        print(f"\nDownloaded to {dest_path}")
+        if dl.sha256:
+            hash_index.store(dest_path, dl.sha256)
+            webui_hashes.store(dest_path, dl.sha256)
+
+        save_preview_and_metadata(folder, filename, data, preview_url, version)
+        job.finish(DONE, f"Downloaded Civitai {model_type} model to: {dest_path}")
+    except Exception as e:
+        # Only a plain stream's .part file is useless, keep the others (even when open() failed
+        # before reading the resume state) so the next attempt can pick up from there
+        if dl is not None and dl.streaming:
+            discard_partial(dest_path)
+        job.finish(FAILED, f"Error downloading from Civitai: {str(e)}")
+
+
+class DownloadQueue:
+    """
+    Holds every download job of this session and runs the queued ones on a pool of
+    worker threads, at most `civitai_max_concurrent_downloads` at a time.
+    Workers are only alive while there is something queued.
+    """
+
+    def __init__(self):
+        self.jobs = []
+        self._lock = threading.Lock()
+        self._workers = []
+
+    def add(self, model_id, model_version_id=None, preview_url=None, front=False):
+        """
+        Add a job, or return the active one already downloading the same model version.
+        With front=True the job goes ahead of the other queued jobs.
+        """
+        with self._lock:
+            job = self._find_duplicate(model_id, model_version_id)
+            if job:
+                return job
+            job = DownloadJob(model_id, model_version_id, preview_url)
+            if front:
+                index = next((i for i, j in enumerate(self.jobs) if j.state == QUEUED), len(self.jobs))
+                self.jobs.insert(index, job)
+            else:
+                self.jobs.append(job)
+        self.schedule()
+        return job
+
+    def _find_duplicate(self, model_id, model_version_id):
+        model_version_id = str(model_version_id) if model_version_id else None
+        for job in self.jobs:
+            if not job.is_active() or job.model_id != str(model_id):
+                continue
+            # No version asked for means whichever one the model's active job downloads
+            if model_version_id in (None, job.requested_version_id, job.model_version_id):
+                return job
+        return None
+
+    def find_duplicate(self, model_id, model_version_id=None):
+        """The active job already downloading this model version, any version of the model for None."""
+        with self._lock:
+            return self._find_duplicate(model_id, model_version_id)
+
+    def get(self, job_id):
+        with self._lock:
+            for job in self.jobs:
+                if job.id == job_id:
+                    return job
+        return None
+
+    def find_active(self, model_id, model_version_id=None):
+        with self._lock:
+            for job in reversed(self.jobs):
+                if job.is_active() and job.model_id == str(model_id) and (
+                    not model_version_id or job.model_version_id == str(model_version_id)
+                ):
+                    return job
+        return None
+
+    def queue_position(self, job):
+        """How many queued jobs are ahead of `job`."""
+        with self._lock:
+            ahead = 0
+            for other in self.jobs:
+                if other is job:
+                    return ahead
+                if other.state == QUEUED:
+                    ahead += 1
+        return 0
+
+    def running_count(self):
+        with self._lock:
+            return sum(1 for job in self.jobs if job.state == RUNNING)
+
+    def has_pending_jobs(self):
+        """Whether a job is queued or running, paused jobs don't count."""
+        with self._lock:
+            return any(job.is_pending() for job in self.jobs)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if not job or not job.is_active():
+            return False
+        with self._lock:
+            if job.state == RUNNING:
+                job.cancel_requested = True
+            else:
+                job.finish(CANCELLED, "Cancelled")
+        return True
+
+    def pause(self, job_id):
+        job = self.get(job_id)
+        if not job:
+            return False
+        with self._lock:
+            if job.state == RUNNING:
+                job.pause_requested = True
+            elif job.state == QUEUED:
+                job.finish(PAUSED, "Paused")
+            else:
+                return False
+        return True
+
+    def resume(self, job_id):
+        job = self.get(job_id)
+        if not job or job.state not in (PAUSED, FAILED, CANCELLED):
+            return False
+        with self._lock:
+            job.state = QUEUED
+            job.message = "Queued"
+            # Cleared here rather than when the job starts, a cancel or pause sent in between must stick
+            job.cancel_requested = job.pause_requested = False
+        self.schedule()
+        return True
+
+    def clear_finished(self):
+        with self._lock:
+            self.jobs = [job for job in self.jobs if job.is_active()]
+
+    def schedule(self):
+        """Start workers for queued jobs, up to the concurrency limit."""
+        limit = get_max_concurrent_downloads()
+        with self._lock:
+            self._workers = [t for t in self._workers if t.is_alive()]
+            queued = sum(1 for job in self.jobs if job.state == QUEUED)
+            running = sum(1 for job in self.jobs if job.state == RUNNING)
+            # Workers busy with a running job can't pick up the queued ones, only idle ones can
+            while len(self._workers) < limit and len(self._workers) - running < queued:
+                t = threading.Thread(target=self._worker, daemon=True)
+                self._workers.append(t)
+                t.start()
+
+    def _next_job(self):
+        """The next queued job, marked RUNNING. When there is none the calling worker retires."""
+        limit = get_max_concurrent_downloads()
+        with self._lock:
+            running = sum(1 for job in self.jobs if job.state == RUNNING)
+            # Lowering the limit takes effect as soon as enough downloads finished
+            if running < limit:
+                for job in self.jobs:
+                    if job.state == QUEUED:
+                        job.state = RUNNING
+                        return job
+            # Leave the pool under the same lock, so schedule() never counts an exiting worker as idle
+            current = threading.current_thread()
+            self._workers = [t for t in self._workers if t is not current]
+        return None
+
+    def _worker(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            # The download runs here, in the background, whatever the UI is doing. The UI only
+            # reads the job's fields, so a closed or slow browser tab can't hold it up.
+            printed = False
+            try:
+                for _ in run_download_job(job):
+                    # One progress bar in the terminal, concurrent ones would overwrite each other
+                    if job.total and self.running_count() == 1:
+                        print_download_progress(job)
+                        printed = True
+            except Exception as e:
+                job.finish(FAILED, f"Error: {str(e)}")
+            if printed:
+                print()  # Newline after terminal progress
+            # A freed slot may allow more workers, e.g. after the limit was raised
+            self.schedule()
+
+
+download_queue = DownloadQueue()
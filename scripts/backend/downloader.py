@@ -0,0 +1,593 @@
+import os
+import json
+import errno
+import shutil
+import hashlib
+import time
+import threading
+from . import http_client
+from .utils import format_size
+from .io_priority import lower_thread_io_priority, drop_page_cache, page_cache_usage, DROP_INTERVAL
+from urllib.parse import urlparse
+
+CHUNK_SIZE = 1024 * 128  # 128KB
+# Network reads are collected and written to the file in blocks of this size, aligned to it
+WRITE_BLOCK_SIZE = 1024 * 1024 * 4  # 4MB
+# Don't bother splitting files into ranges smaller than this
+MIN_SEGMENT_SIZE = 1024 * 1024 * 16  # 16MB
+# How many bytes a worker writes between two saves of the resume state
+STATE_SAVE_INTERVAL = 1024 * 1024 * 8  # 8MB
+# Read size when hashing bytes that reached the disk ahead of the hash cursor
+HASH_READ_SIZE = 1024 * 1024  # 1MB
+# How far a bandwidth limit may be exceeded in a burst
+BANDWIDTH_BURST_SECONDS = 0.5
+
+
+def robust_get(url, headers=None, stream=False, timeout=15, max_retries=5, start=0):
+    """
+    GET through the shared session, retried with backoff on top of the session's own retries.
+    With `start` > 0 the request asks for the rest of the file from that byte on, so a dropped
+    stream can be picked up where it stopped.
+    """
+    headers = dict(headers or {})
+    if start > 0:
+        headers["Range"] = f"bytes={start}-"
+    last_exc = None
+    for attempt in range(1, max_retries + 1):
+        try:
+            resp = http_client.get(url, headers=headers, stream=stream, timeout=(http_client.CONNECT_TIMEOUT, timeout))
+            resp.raise_for_status()
+            return resp
+        except Exception as e:
+            print(f"Attempt {attempt} failed for {url}: {e}")
+            last_exc = e
+            if attempt < max_retries:
+                time.sleep(http_client.backoff_delay(attempt))
+    raise last_exc
+
+
+class BandwidthLimiter:
+    """
+    Caps the bytes per second passed through consume(), shared by every thread that calls it.
+    A rate of 0 means unlimited. The rate can be changed while downloads are running.
+    """
+
+    def __init__(self, rate=0):
+        self.rate = rate
+        self._allowance = 0.0
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self._lock:
+            if rate != self.rate:
+                self.rate = rate
+                self._allowance = 0.0
+                self._last = time.monotonic()
+
+    def consume(self, n):
+        """Account for `n` bytes, sleeping as long as needed to stay under the rate."""
+        with self._lock:
+            if self.rate <= 0:
+                return
+            now = time.monotonic()
+            burst = self.rate * BANDWIDTH_BURST_SECONDS
+            self._allowance = min(burst, self._allowance + (now - self._last) * self.rate) - n
+            self._last = now
+            wait = -self._allowance / self.rate if self._allowance < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+# Limit shared by all downloads, on top of each download's own
+download_bandwidth = BandwidthLimiter()
+
+
+def supports_range_requests(resp):
+    """True if the response advertises byte ranges and a known content length."""
+    accept_ranges = resp.headers.get("accept-ranges", "").lower()
+    total = int(resp.headers.get("content-length", 0) or 0)
+    return accept_ranges == "bytes" and total > 0
+
+
+def split_ranges(total, connections):
+    """
+    Split [0, total) into at most `connections` inclusive (start, end) byte ranges,
+    never making a range smaller than MIN_SEGMENT_SIZE.
+    """
+    connections = max(1, min(connections, total // MIN_SEGMENT_SIZE))
+    size = total // connections
+    ranges = []
+    start = 0
+    for i in range(connections):
+        end = total - 1 if i == connections - 1 else start + size - 1
+        ranges.append((start, end))
+        start = end + 1
+    return ranges
+
+
+def _write_all(f, data):
+    """Write everything to an unbuffered file, which may accept less than asked for."""
+    view = memoryview(data)
+    while view:
+        written = f.write(view)
+        view = view[written:]
+
+
+def preallocate(f, size):
+    """
+    Reserve `size` bytes for `f` on disk up front, so a multi-GB model isn't written as many
+    fragments and a full disk shows up before the download starts rather than near its end.
+    Raises IOError with the sizes involved when there isn't enough free space.
+    """
+    try:
+        allocated = os.fstat(f.fileno()).st_blocks * 512
+    except (OSError, AttributeError):
+        allocated = 0
+    free = shutil.disk_usage(os.path.dirname(os.path.abspath(f.name))).free
+    if size - allocated > free:
+        raise IOError(f"Not enough disk space: {format_size(size - allocated)} needed, {format_size(free)} free")
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)
+            return
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                raise IOError(f"Not enough disk space: {format_size(size)} needed, {format_size(free)} free") from e
+            # Filesystems without fallocate support (EOPNOTSUPP) get a sparse file instead
+    f.truncate(size)
+
+
+class BlockWriter:
+    """
+    Collects network reads in one reusable buffer and writes them to an unbuffered file in
+    WRITE_BLOCK_SIZE blocks aligned to that size, instead of one small write per read.
+    `on_write(offset, data)` is called with every block once it's in the file, `data` is only
+    valid during the call.
+    """
+
+    def __init__(self, f, pos, on_write, block_size=WRITE_BLOCK_SIZE):
+        self.f = f
+        self.pos = pos
+        self.on_write = on_write
+        self._buf = bytearray(block_size)
+        self._view = memoryview(self._buf)
+        self._fill = 0
+        # The first block ends at the next block boundary
+        self._limit = block_size - pos % block_size
+        f.seek(pos)
+
+    def write(self, data):
+        data = memoryview(data)
+        while data:
+            n = min(len(data), self._limit - self._fill)
+            self._view[self._fill:self._fill + n] = data[:n]
+            self._fill += n
+            data = data[n:]
+            if self._fill == self._limit:
+                self.flush()
+
+    def flush(self):
+        if not self._fill:
+            return
+        block = self._view[:self._fill]
+        _write_all(self.f, block)
+        self.on_write(self.pos, block)
+        self.pos += self._fill
+        self._fill = 0
+        self._limit = len(self._buf)
+
+
+def get_part_paths(dest_path):
+    """Returns (part_path, state_path) used while `dest_path` is being downloaded."""
+    part_path = dest_path + ".part"
+    return part_path, part_path + ".json"
+
+
+def load_resume_state(dest_path, url, total, etag):
+    """
+    Returns the saved ranges for an interrupted download of `url` into `dest_path`,
+    or None if there is nothing usable to resume from.
+    """
+    part_path, state_path = get_part_paths(dest_path)
+    if not os.path.exists(part_path) or not os.path.exists(state_path):
+        return None
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except Exception as e:
+        print(f"Failed to read resume state {state_path}: {e}")
+        return None
+    if state.get("url") != url or state.get("total") != total:
+        return None
+    # Only trust the ETag when both sides have one
+    if etag and state.get("etag") and state.get("etag") != etag:
+        return None
+    if os.path.getsize(part_path) != total:
+        return None
+    try:
+        return [[int(start), int(end), int(pos)] for start, end, pos in state["ranges"]]
+    except Exception:
+        return None
+
+
+def discard_partial(dest_path):
+    """Remove the .part file and its resume state, if any."""
+    for path in get_part_paths(dest_path):
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+        except Exception as e:
+            print(f"Failed to remove partial file {path}: {e}")
+
+
+class Download:
+    """
+    Downloads `url` into `dest_path` through a `<name>.part` file with a small `.part.json`
+    sidecar recording the URL, size, ETag and the progress of every byte range.
+    When the server supports HTTP Range the file is fetched as one or more ranges in parallel
+    worker threads, an interrupted download is resumed from the sidecar and a dropped
+    connection is reopened from the last byte received. Otherwise a single stream is used.
+
+    The SHA256 of the file is computed while it downloads: bytes arriving in file order are
+    hashed as they stream through, bytes of later ranges that arrive early are picked up from
+    the page cache once the hash reaches them. The result is in `sha256` after finish().
+
+    Progress is exposed through `downloaded`/`total`, so the caller can poll it from its own loop.
+
+    The .part file is preallocated and written in large aligned blocks. Every worker flushes
+    and drops the pages it wrote from the page cache every DROP_INTERVAL bytes, so a big download
+    doesn't evict the models in use; bytes hashed after that are read back from disk.
+
+    `speed_limit` caps this download in bytes per second, on top of `download_bandwidth`. With
+    `low_priority` the workers use the lowest I/O priority.
+    """
+
+    def __init__(self, url, dest_path, headers=None, connections=1, timeout=15, max_retries=5,
+                 speed_limit=0, low_priority=False):
+        self.url = url
+        self.dest_path = dest_path
+        self.part_path, self.state_path = get_part_paths(dest_path)
+        self.headers = headers or {}
+        self.connections = connections
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.total = 0
+        self.etag = None
+        self.downloaded = 0
+        self.resumed_bytes = 0
+        self.ranges = None  # [start, end, next_pos] per range, None for a plain stream
+        # Set by open() when the server can't serve ranges, the .part file is then written from scratch
+        self.streaming = False
+        self.error = None
+        self.sha256 = None
+        self._hasher = hashlib.sha256()
+        self._hash_pos = 0
+        self._hash_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._threads = []
+        self.bandwidth = BandwidthLimiter(speed_limit)
+        self.low_priority = low_priority
+        self._started_at = None
+        self._cache_before = None
+        self._cache_peak = None
+
+    def open(self):
+        """Probe the URL and prepare the .part file. Blocking, raises on HTTP errors."""
+        r = robust_get(self.url, headers=self.headers, stream=True, timeout=self.timeout,
+                       max_retries=self.max_retries)
+        self.total = int(r.headers.get("content-length", 0) or 0)
+        self.etag = r.headers.get("etag") or r.headers.get("last-modified")
+
+        if not supports_range_requests(r):
+            # No way to resume, start over from the probe response
+            self.streaming = True
+            discard_partial(self.dest_path)
+            try:
+                with open(self.part_path, "wb") as f:
+                    if self.total:
+                        preallocate(f, self.total)
+            except Exception:
+                r.close()
+                raise
+            self._threads.append(threading.Thread(target=self._fetch_stream, args=(r,), daemon=True))
+            return
+
+        # The probe response is only used for its headers, the ranges use their own connections
+        r.close()
+        # r.url is the final (signed CDN) URL after redirects, don't leak the API key to it
+        self._range_url = r.url
+        if urlparse(r.url).netloc == urlparse(self.url).netloc:
+            self._range_headers = dict(self.headers)
+        else:
+            self._range_headers = {}
+
+        self.ranges = load_resume_state(self.dest_path, self.url, self.total, self.etag)
+        if self.ranges is not None:
+            self.resumed_bytes = sum(pos - start for start, _, pos in self.ranges)
+            print(f"Resuming {os.path.basename(self.dest_path)} from {self.resumed_bytes // 1024 // 1024}MB")
+            # Older .part files may be sparse, allocate what's missing
+            with open(self.part_path, "r+b") as f:
+                preallocate(f, self.total)
+        else:
+            discard_partial(self.dest_path)
+            self.ranges = [[start, end, start] for start, end in split_ranges(self.total, self.connections)]
+            # Preallocate so every worker can seek to its own offset
+            with open(self.part_path, "wb") as f:
+                preallocate(f, self.total)
+            self._save_state()
+        self.downloaded = self.resumed_bytes
+
+        for index, (_, end, pos) in enumerate(self.ranges):
+            if pos <= end:
+                self._threads.append(threading.Thread(target=self._fetch_range, args=(index,), daemon=True))
+        self._threads.append(threading.Thread(target=self._hash_behind, daemon=True))
+
+    def start(self):
+        self._started_at = time.time()
+        self._cache_before = page_cache_usage()
+        for t in self._threads:
+            t.start()
+
+    def _save_state(self):
+        with self._lock:
+            state = {
+                "url": self.url,
+                "total": self.total,
+                "etag": self.etag,
+                "ranges": [list(rng) for rng in self.ranges],
+            }
+        with self._state_lock:
+            tmp_path = self.state_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.state_path)
+
+    def _fail(self, e):
+        with self._lock:
+            if self.error is None:
+                self.error = e
+        # One failed range fails the whole file, stop the other workers
+        self._cancel.set()
+
+    def _start_worker(self):
+        if self.low_priority:
+            lower_thread_io_priority()
+
+    def _throttle(self, n):
+        download_bandwidth.consume(n)
+        self.bandwidth.consume(n)
+
+    def _hash_chunk(self, offset, data):
+        """Feed `data` to the hash if it is the next thing the hash is waiting for."""
+        with self._hash_lock:
+            if offset != self._hash_pos:
+                return
+            self._hasher.update(data)
+            self._hash_pos += len(data)
+
+    def _sample_page_cache(self):
+        usage = page_cache_usage()
+        if usage is not None:
+            with self._lock:
+                self._cache_peak = max(self._cache_peak or 0, usage)
+
+    def _drop_written(self, f, start, end):
+        """Flush what a worker wrote to `f` in [start, end) and drop it from the page cache."""
+        if end <= start:
+            return
+        # Just before a drop is when this download holds the most pages
+        self._sample_page_cache()
+        drop_page_cache(f.fileno(), start, end - start, flush=True)
+
+    def _hash_behind(self):
+        """
+        Hashes, in file order, the bytes that were written before the hash cursor reached them:
+        later ranges downloading ahead of the first one, or bytes resumed from a .part file.
+        """
+        self._start_worker()
+        try:
+            # Unbuffered: a buffered reader would read ahead past `written` and later serve
+            # those bytes, still zeros in the preallocated file, from its buffer
+            with open(self.part_path, "rb", buffering=0) as f:
+                while not self._cancel.is_set():
+                    with self._hash_lock:
+                        hash_pos = self._hash_pos
+                    if hash_pos >= self.total:
+                        return
+                    with self._lock:
+                        written = next(pos for start, end, pos in self.ranges if start <= hash_pos <= end)
+                    if written <= hash_pos:
+                        time.sleep(0.1)
+                        continue
+                    f.seek(hash_pos)
+                    data = f.read(min(written - hash_pos, HASH_READ_SIZE))
+                    # A range worker may have hashed these bytes itself in the meantime
+                    self._hash_chunk(hash_pos, data)
+                    # Read back only for the hash, don't keep it cached. Pages still dirty stay.
+                    drop_page_cache(f.fileno(), hash_pos, len(data))
+        except Exception as e:
+            self._fail(e)
+
+    def _fetch_range(self, index):
+        start, end, pos = self.ranges[index]
+        failures = 0
+        self._start_worker()
+        saved = dropped = pos
+
+        def on_write(offset, block):
+            nonlocal saved, dropped
+            self._hash_chunk(offset, block)
+            written = offset + len(block)
+            with self._lock:
+                self.ranges[index][2] = written
+                self.downloaded += len(block)
+            if written - dropped >= DROP_INTERVAL:
+                self._drop_written(f, dropped, written)
+                dropped = written
+            if written - saved >= STATE_SAVE_INTERVAL:
+                self._save_state()
+                saved = written
+
+        try:
+            # Unbuffered, so every byte counted in self.ranges is already visible in the file
+            with open(self.part_path, "r+b", buffering=0) as f:
+                writer = BlockWriter(f, pos, on_write)
+                try:
+                    while pos <= end and not self._cancel.is_set():
+                        headers = dict(self._range_headers)
+                        headers["Range"] = f"bytes={pos}-{end}"
+                        attempt_start = pos
+                        try:
+                            with http_client.get(self._range_url, headers=headers, stream=True, timeout=(http_client.CONNECT_TIMEOUT, self.timeout)) as r:
+                                r.raise_for_status()
+                                if r.status_code != 206:
+                                    raise IOError(f"Server ignored the Range header (HTTP {r.status_code})")
+                                while pos <= end:
+                                    if self._cancel.is_set():
+                                        break
+                                    chunk = r.raw.read(min(CHUNK_SIZE, end - pos + 1))
+                                    if not chunk:
+                                        break
+                                    writer.write(chunk)
+                                    self._throttle(len(chunk))
+                                    pos += len(chunk)
+                            if pos <= end and not self._cancel.is_set():
+                                raise IOError(f"Connection closed at byte {pos} of range {start}-{end}")
+                        except Exception as e:
+                            if self._cancel.is_set():
+                                break
+                            failures = 0 if pos > attempt_start else failures + 1
+                            if failures >= self.max_retries:
+                                raise
+                            print(f"Range {start}-{end} dropped at byte {pos}, resuming: {e}")
+                            time.sleep(http_client.backoff_delay(failures + 1))
+                finally:
+                    # Keep what was received, so the resume state doesn't lose it
+                    writer.flush()
+                    self._drop_written(f, dropped, writer.pos)
+        except Exception as e:
+            self._fail(e)
+        finally:
+            try:
+                self._save_state()
+            except Exception as e:
+                print(f"Failed to save resume state: {e}")
+
+    def _fetch_stream(self, r):
+        pos = 0
+        failures = 0
+        dropped = 0
+        self._start_worker()
+
+        def on_write(offset, block):
+            nonlocal dropped
+            self._hash_chunk(offset, block)
+            with self._lock:
+                self.downloaded += len(block)
+            written = offset + len(block)
+            if written - dropped >= DROP_INTERVAL:
+                self._drop_written(f, dropped, written)
+                dropped = written
+
+        try:
+            # The file was created and preallocated by open(), so don't truncate it
+            with open(self.part_path, "r+b", buffering=0) as f:
+                writer = BlockWriter(f, 0, on_write)
+                try:
+                    while not self._cancel.is_set():
+                        attempt_start = pos
+                        try:
+                            with r:
+                                while not self._cancel.is_set():
+                                    chunk = r.raw.read(CHUNK_SIZE)
+                                    if not chunk:
+                                        break
+                                    writer.write(chunk)
+                                    self._throttle(len(chunk))
+                                    pos += len(chunk)
+                            if self.total and pos < self.total and not self._cancel.is_set():
+                                raise IOError(f"Connection closed at byte {pos} of {self.total}")
+                            break
+                        except Exception as e:
+                            if self._cancel.is_set():
+                                break
+                            failures = 0 if pos > attempt_start else failures + 1
+                            if failures >= self.max_retries:
+                                raise
+                            print(f"Stream dropped at byte {pos}, resuming: {e}")
+                            r = robust_get(self.url, headers=self.headers, stream=True, timeout=self.timeout,
+                                           max_retries=self.max_retries, start=pos)
+                            if r.status_code != 206:
+                                r.close()
+                                raise IOError("Connection dropped and the server does not support resuming") from e
+                finally:
+                    writer.flush()
+                    self._drop_written(f, dropped, writer.pos)
+        except Exception as e:
+            self._fail(e)
+
+    @property
+    def resumable(self):
+        """False for plain streams, whose .part file can't be resumed later."""
+        return self.ranges is not None
+
+    def cancel(self):
+        self._cancel.set()
+
+    def is_cancelled(self):
+        return self._cancel.is_set()
+
+    def is_alive(self):
+        return any(t.is_alive() for t in self._threads)
+
+    def join(self, timeout=None):
+        for t in self._threads:
+            t.join(timeout)
+
+    def finish(self, expected_sha256=None):
+        """
+        Move the completed .part file into place. Call after the workers have stopped.
+        If `expected_sha256` is given and doesn't match, the file is moved to `<name>.corrupt`
+        instead and an error is raised.
+        """
+        if self.error:
+            raise self.error
+        if self.ranges is not None and any(pos <= end for _, end, pos in self.ranges):
+            raise IOError("Download incomplete, the partial file was kept for resuming")
+        if self.ranges is None and self.total and self.downloaded != self.total:
+            raise IOError(f"Download incomplete: got {self.downloaded} of {self.total} bytes")
+        with self._hash_lock:
+            if self._hash_pos == (self.total or self.downloaded):
+                self.sha256 = self._hasher.hexdigest()
+        if expected_sha256 and self.sha256 and self.sha256 != expected_sha256.lower():
+            corrupt_path = self.dest_path + ".corrupt"
+            os.replace(self.part_path, corrupt_path)
+            if os.path.exists(self.state_path):
+                os.remove(self.state_path)
+            raise IOError(
+                f"Corrupt download, SHA256 {self.sha256} does not match the expected "
+                f"{expected_sha256.lower()}. The file was moved to {corrupt_path}"
+            )
+        os.replace(self.part_path, self.dest_path)
+        if os.path.exists(self.state_path):
+            os.remove(self.state_path)
+        self._print_stats()
+
+    def _print_stats(self):
+        """Throughput and page cache growth of this download, to compare write strategies."""
+        if not self._started_at:
+            return
+        elapsed = max(time.time() - self._started_at, 0.001)
+        fetched = self.downloaded - self.resumed_bytes
+        line = f"Wrote {format_size(fetched)} in {elapsed:.1f}s ({fetched / elapsed / 1024 / 1024:.1f}MB/s)"
+        cache_after = page_cache_usage()
+        if self._cache_before is not None and cache_after is not None:
+            peak = max(self._cache_peak or 0, cache_after)
+            line += (
+                f", page cache {(peak - self._cache_before) / 1024 / 1024:+.0f}MB at peak, "
+                f"{(cache_after - self._cache_before) / 1024 / 1024:+.0f}MB after"
+            )
+        print(line)
@@ -0,0 +1,179 @@
+import os
+import time
+import sqlite3
+import threading
+from .utils import get_extension_data_path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    sha256 TEXT,
+    autov2 TEXT,
+    blake3 TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS hashes_sha256 ON hashes (sha256);
+"""
+
+# SQLite limits the number of ? parameters per statement
+LOOKUP_BATCH = 500
+
+
+def file_key(path, st=None):
+    """(real path, size, mtime_ns, inode) identifying the current contents of a file."""
+    st = st or os.stat(path)
+    return os.path.realpath(path), st.st_size, st.st_mtime_ns, st.st_ino
+
+
+def autov2_of(sha256):
+    """The short hash the WebUI and Civitai show for a model: the first 10 hex digits of its SHA256."""
+    return sha256[:10] if sha256 else None
+
+
+class HashIndex:
+    """
+    Local SQLite index mapping a model file to its hashes. Entries are keyed by real path and
+    only trusted while the file's size, mtime and inode are unchanged, so a replaced file is
+    hashed again instead of reusing a stale hash.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def lookup(self, path, st=None):
+        """Returns {sha256, autov2, blake3} for `path`, or None if unknown or the file changed."""
+        try:
+            key = file_key(path, st)
+        except OSError:
+            return None
+        return self._lookup_keys([key]).get(key[0])
+
+    def lookup_many(self, paths):
+        """Bulk lookup, returns {path: {sha256, autov2, blake3}} for every path with a valid entry."""
+        keys = {}
+        for path in paths:
+            try:
+                keys[path] = file_key(path)
+            except OSError:
+                continue
+        found = self._lookup_keys(keys.values())
+        return {path: found[key[0]] for path, key in keys.items() if key[0] in found}
+
+    def _lookup_keys(self, keys):
+        keys = {key[0]: key for key in keys}
+        found = {}
+        stale = []
+        real_paths = list(keys)
+        with self._lock:
+            conn = self._connection()
+            for i in range(0, len(real_paths), LOOKUP_BATCH):
+                batch = real_paths[i:i + LOOKUP_BATCH]
+                rows = conn.execute(
+                    f"SELECT * FROM hashes WHERE path IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for row in rows:
+                    _, size, mtime_ns, inode = keys[row["path"]]
+                    if (row["size"], row["mtime_ns"], row["inode"]) != (size, mtime_ns, inode):
+                        stale.append(row["path"])
+                        continue
+                    found[row["path"]] = {
+                        "sha256": row["sha256"],
+                        "autov2": row["autov2"],
+                        "blake3": row["blake3"],
+                    }
+            if stale:
+                conn.executemany("DELETE FROM hashes WHERE path = ?", [(p,) for p in stale])
+                conn.commit()
+        return found
+
+    def store(self, path, sha256, blake3=None, st=None):
+        """
+        Record the hashes of `path`. Pass the os.stat() taken before hashing as `st`, so a file
+        that changed while it was being hashed doesn't get its old hash recorded as current.
+        """
+        self.store_many([(path, sha256, blake3, st)])
+
+    def store_many(self, entries):
+        """Record many (path, sha256, blake3, st) entries in one transaction."""
+        rows = []
+        now = time.time()
+        for path, sha256, blake3, st in entries:
+            try:
+                real_path, size, mtime_ns, inode = file_key(path, st)
+            except OSError:
+                continue
+            sha256 = sha256.lower() if sha256 else None
+            blake3 = blake3.lower() if blake3 else None
+            rows.append((real_path, size, mtime_ns, inode, sha256, autov2_of(sha256), blake3, now))
+        if not rows:
+            return
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(
+                "INSERT OR REPLACE INTO hashes (path, size, mtime_ns, inode, sha256, autov2, blake3, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            conn.commit()
+
+    def invalidate(self, path):
+        """Forget `path`, e.g. after it was deleted or replaced."""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("DELETE FROM hashes WHERE path = ?", (os.path.realpath(path),))
+            conn.commit()
+
+    def find_by_sha256(self, sha256):
+        """Paths of every indexed file with this SHA256, for duplicate detection."""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT path FROM hashes WHERE sha256 = ?", (sha256.lower(),)
+            ).fetchall()
+        return [row["path"] for row in rows]
+
+    def prune(self):
+        """Drop entries of files that no longer exist. Returns how many were removed."""
+        with self._lock:
+            paths = [row["path"] for row in self._connection().execute("SELECT path FROM hashes").fetchall()]
+        # Stat outside the lock, lookups and stores shouldn't wait for a whole library's worth of them
+        missing = [p for p in paths if not os.path.exists(p)]
+        if not missing:
+            return 0
+        with self._lock:
+            # A file can come back (e.g. a finished download) between the check and here
+            missing = [(p,) for p in missing if not os.path.exists(p)]
+            conn = self._connection()
+            conn.executemany("DELETE FROM hashes WHERE path = ?", missing)
+            conn.commit()
+        return len(missing)
+
+
+hash_index = HashIndex(get_extension_data_path("hash_index.sqlite3"))
+
+
+def prune_hash_index():
+    try:
+        removed = hash_index.prune()
+    except sqlite3.Error as e:
+        print(f"Failed to prune the hash index: {e}")
+        return
+    if removed:
+        print(f"Removed {removed} deleted files from the hash index")
+
+
+def on_app_started(demo, app):
+    # Checks every indexed path, so keep it off the WebUI start
+    threading.Thread(target=prune_hash_index, daemon=True).start()
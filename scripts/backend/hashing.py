@@ -0,0 +1,247 @@
+import os
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
+from .hash_index import hash_index
+from . import webui_hashes
+from .utils import get_low_io_priority, format_size
+from .io_priority import lower_thread_io_priority, drop_page_cache, DROP_INTERVAL
+
+try:
+    from blake3 import blake3
+except ImportError:
+    blake3 = None
+
+# hashlib releases the GIL on large updates, so threads hash in parallel
+BUFFER_SIZE = 1024 * 1024 * 4  # 4MB
+MAX_WORKERS = 8
+
+
+class HashCancelled(Exception):
+    pass
+
+
+def hash_file(filepath, buffer_size=BUFFER_SIZE, on_bytes=None, is_cancelled=None, low_priority=False):
+    """
+    Returns (sha256, blake3) of a file in a single read through one reusable buffer.
+    blake3 is None when the blake3 package isn't installed.
+    With `low_priority` the calling thread's I/O priority is lowered for good and the pages read
+    are dropped from the page cache as it goes, only use it from worker threads.
+    """
+    h = hashlib.sha256()
+    b = blake3() if blake3 else None
+    buf = bytearray(buffer_size)
+    view = memoryview(buf)
+    if low_priority:
+        lower_thread_io_priority()
+    pos = dropped = 0
+    with open(filepath, 'rb', buffering=0) as f:
+        while True:
+            if is_cancelled and is_cancelled():
+                raise HashCancelled(filepath)
+            n = f.readinto(buf)
+            if not n:
+                break
+            h.update(view[:n])
+            if b:
+                b.update(view[:n])
+            if on_bytes:
+                on_bytes(n)
+            pos += n
+            if low_priority and pos - dropped >= DROP_INTERVAL:
+                drop_page_cache(f.fileno(), dropped, pos - dropped)
+                dropped = pos
+        if low_priority:
+            drop_page_cache(f.fileno(), dropped)
+    return h.hexdigest(), b.hexdigest() if b else None
+
+
+def sha256_of_file(filepath):
+    return hash_file(filepath)[0]
+
+
+def import_legacy_hash(file_path, st=None):
+    """
+    Older versions kept a .sha256 file next to each model. Move its hash into the index
+    if the model didn't change since, and return it.
+    """
+    hash_path = os.path.splitext(file_path)[0] + '.sha256'
+    try:
+        st = st or os.stat(file_path)
+        if not os.path.exists(hash_path) or os.path.getmtime(hash_path) < st.st_mtime:
+            return None
+        with open(hash_path, 'r', encoding='utf-8') as hf:
+            file_hash = hf.read().strip().lower()
+    except OSError:
+        return None
+    if not file_hash:
+        return None
+    hash_index.store(file_path, file_hash, st=st)
+    return file_hash
+
+
+def import_webui_hash(file_path, st=None):
+    """Take the hash from the WebUI's own cache.json if it has a current one, and index it."""
+    file_hash = webui_hashes.lookup(file_path)
+    if file_hash:
+        hash_index.store(file_path, file_hash, st=st)
+    return file_hash
+
+
+def lookup_known_hashes(paths):
+    """
+    {path: sha256} for every path whose hash is already known, from the hash index, an old
+    .sha256 file or the WebUI's hash cache, without reading any model file.
+    """
+    known = {path: entry['sha256'] for path, entry in hash_index.lookup_many(paths).items() if entry['sha256']}
+    for path in paths:
+        if path not in known:
+            file_hash = import_legacy_hash(path) or import_webui_hash(path)
+            if file_hash:
+                known[path] = file_hash
+    return known
+
+
+def is_rotational(path):
+    """True if `path` lives on a spinning disk. Only known on Linux, anything else counts as SSD."""
+    try:
+        st = os.stat(path)
+        dev = f"/sys/dev/block/{os.major(st.st_dev)}:{os.minor(st.st_dev)}"
+        for queue in (os.path.join(dev, "queue"), os.path.join(dev, "..", "queue")):
+            flag = os.path.join(queue, "rotational")
+            if os.path.exists(flag):
+                with open(flag, "r") as f:
+                    return f.read().strip() == "1"
+    except (OSError, AttributeError, ValueError):
+        pass
+    return False
+
+
+def get_hash_workers(paths):
+    """
+    Thread count for hashing `paths`: one per core on SSDs, capped at MAX_WORKERS, but only one
+    per disk on spinning disks where parallel reads just make the heads seek back and forth.
+    """
+    devices = {}
+    for path in paths:
+        try:
+            dev = os.stat(path).st_dev
+        except OSError:
+            continue
+        if dev not in devices:
+            devices[dev] = is_rotational(path)
+    if devices and all(devices.values()):
+        return len(devices)
+    return max(1, min(os.cpu_count() or 1, MAX_WORKERS))
+
+
+class HashProgress:
+    """Bytes hashed out of the total size of `paths`, pass add() as hash_file's on_bytes. Thread-safe."""
+
+    def __init__(self, paths):
+        self.bytes_done = 0
+        self.bytes_total = 0
+        for path in paths:
+            try:
+                self.bytes_total += os.path.getsize(path)
+            except OSError:
+                pass
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    def add(self, n):
+        with self._lock:
+            self.bytes_done += n
+
+    def rate(self):
+        """Bytes hashed per second so far."""
+        elapsed = time.time() - self.started_at
+        return self.bytes_done / elapsed if elapsed > 0 else 0
+
+    def status(self):
+        if not self.bytes_total:
+            return ""
+        return (
+            f"Hashed {format_size(self.bytes_done)}/{format_size(self.bytes_total)} "
+            f"({self.rate() / 1024 / 1024:.1f}MB/s)"
+        )
+
+
+class HashJob:
+    """
+    Hashes many files on a thread pool and records the results in the hash index.
+    Results are in `results` ({path: sha256}) and `errors` ({path: exception}).
+    """
+
+    def __init__(self, paths, workers=None):
+        self.paths = list(paths)
+        self.workers = workers or get_hash_workers(self.paths)
+        self.results = {}
+        self.errors = {}
+        self.files_done = 0
+        self.progress = HashProgress(self.paths)
+        self.low_priority = get_low_io_priority()
+
+    def _hash_one(self, path, is_cancelled):
+        st = os.stat(path)
+        file_hash, file_blake3 = hash_file(path, on_bytes=self.progress.add, is_cancelled=is_cancelled,
+                                           low_priority=self.low_priority)
+        hash_index.store(path, file_hash, file_blake3, st=st)
+        return file_hash
+
+    def status(self):
+        progress = self.progress
+        return (
+            f"Hashing {self.files_done}/{len(self.paths)} files "
+            f"({format_size(progress.bytes_done)}/{format_size(progress.bytes_total)}, "
+            f"{progress.rate() / 1024 / 1024:.1f}MB/s, {self.workers} threads)"
+        )
+
+    def run(self, is_cancelled=None, interval=0.5):
+        """
+        Generator hashing every file, yielding itself about every `interval` seconds so the
+        caller can report status(). Stops early once is_cancelled() returns True.
+        """
+        self.progress.started_at = time.time()
+        if not self.paths:
+            return
+        cancel = is_cancelled or (lambda: False)
+        pool = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            futures = {pool.submit(self._hash_one, path, cancel): path for path in self.paths}
+            pending = set(futures)
+            while pending:
+                try:
+                    for future in as_completed(pending, timeout=interval):
+                        pending.discard(future)
+                        path = futures[future]
+                        try:
+                            self.results[path] = future.result()
+                        except HashCancelled:
+                            pass
+                        except Exception as e:
+                            self.errors[path] = e
+                        self.files_done += 1
+                except TimeoutError:
+                    pass
+                if cancel():
+                    break
+                yield self
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def run_to_end(self, is_cancelled=None):
+        for _ in self.run(is_cancelled):
+            pass
+        return self.results
+
+
+def hash_files(paths, workers=None):
+    """
+    Bulk API: hash `paths` in parallel and return {path: sha256}. The results go into the
+    hash index and the WebUI's hash cache.
+    """
+    results = HashJob(paths, workers).run_to_end()
+    webui_hashes.store_many(results)
+    return results
@@ -0,0 +1,131 @@
+import time
+import random
+import threading
+import requests
+from http.cookiejar import DefaultCookiePolicy
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import urlparse
+from .domain_health import domain_health, CIVITAI_DOMAINS
+from .rate_limiter import rate_limiter
+
+# (connect, read) timeouts for every request that doesn't pass its own
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 30
+DEFAULT_TIMEOUT = (CONNECT_TIMEOUT, READ_TIMEOUT)
+# Connection pools kept per scheme, and connections kept alive per host
+POOL_CONNECTIONS = 8
+POOL_MAXSIZE = 32
+# Retries done by the adapter before a response or an error reaches the caller
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 1.0
+BACKOFF_MAX = 30.0
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# 429s from the API are retried by the rate limiter instead, which slows every request down
+API_RETRY_STATUSES = (500, 502, 503, 504)
+MAX_THROTTLED_RETRIES = 10
+
+
+def backoff_delay(attempt, factor=BACKOFF_FACTOR, maximum=BACKOFF_MAX):
+    """
+    Seconds to wait before retry number `attempt` (1-based): exponential, capped, with full
+    jitter so threads that failed together don't all retry at the same moment.
+    """
+    return random.uniform(0, min(maximum, factor * 2 ** (attempt - 1)))
+
+
+class JitterRetry(Retry):
+    """urllib3 Retry using backoff_delay. Retry-After on 429/503 still takes precedence."""
+
+    def get_backoff_time(self):
+        consecutive = 0
+        for entry in reversed(self.history):
+            if entry.redirect_location:
+                break
+            consecutive += 1
+        if consecutive <= 1:
+            return 0
+        return backoff_delay(consecutive - 1)
+
+
+def _make_adapter(status_forcelist):
+    retry = JitterRetry(
+        total=MAX_RETRIES,
+        connect=MAX_RETRIES,
+        read=MAX_RETRIES,
+        status=MAX_RETRIES,
+        status_forcelist=status_forcelist,
+        # The by-hash POST only reads, so it's as safe to retry as a GET
+        allowed_methods=frozenset(["HEAD", "GET", "POST"]),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    return HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+
+
+def _make_session():
+    adapter = _make_adapter(RETRY_STATUSES)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    # requests picks the longest matching prefix, so the API gets its own adapter
+    api_adapter = _make_adapter(API_RETRY_STATUSES)
+    for domain in CIVITAI_DOMAINS:
+        session.mount(f"https://{domain}/api/v1/", api_adapter)
+    # Threads share the session, so keep no cookies that one request could leak into another
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    return session
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """The process-wide requests.Session. Sessions are safe to share for plain requests like ours."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _make_session()
+    return _session
+
+
+def request(method, url, **kwargs):
+    """
+    Like requests.request, through the shared session and with DEFAULT_TIMEOUT unless given.
+    Civitai API requests wait for the rate limiter, and are sent again after a 429.
+    """
+    kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+    host = urlparse(url).hostname
+    limited = rate_limiter.applies_to(url)
+    attempt = 0
+    while True:
+        attempt += 1
+        if limited:
+            rate_limiter.acquire()
+        started = time.monotonic()
+        try:
+            resp = get_session().request(method, url, **kwargs)
+        except Exception:
+            domain_health.record(host, time.monotonic() - started, ok=False)
+            if limited:
+                rate_limiter.release(failed=True)
+            raise
+        throttled = resp.status_code == 429
+        # Being rate limited says nothing about the domain's health when the limiter handles it
+        domain_health.record(host, time.monotonic() - started, ok=resp.status_code < 500 and (limited or not throttled))
+        if not limited:
+            return resp
+        rate_limiter.release(throttled=throttled, retry_after=resp.headers.get("Retry-After"))
+        if not throttled or attempt > MAX_THROTTLED_RETRIES:
+            return resp
+        resp.close()
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
@@ -0,0 +1,80 @@
+import os
+import ctypes
+import platform
+import threading
+
+# ioprio_set(2) isn't wrapped by Python, these are its syscall numbers per architecture
+_IOPRIO_SET_SYSCALLS = {
+    "x86_64": 251,
+    "amd64": 251,
+    "i386": 289,
+    "i686": 289,
+    "aarch64": 30,
+    "arm64": 30,
+    "armv7l": 314,
+    "ppc64le": 273,
+}
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_CLASS_SHIFT = 13
+_IOPRIO_CLASS_BE = 2
+# Lowest best-effort level, like `ionice -c2 -n7`. The idle class could starve downloads entirely.
+_IOPRIO_LOWEST_BE = (_IOPRIO_CLASS_BE << _IOPRIO_CLASS_SHIFT) | 7
+
+# Bytes read or written between two page cache drops
+DROP_INTERVAL = 1024 * 1024 * 64  # 64MB
+
+_libc = None
+_libc_lock = threading.Lock()
+
+
+def _get_libc():
+    global _libc
+    with _libc_lock:
+        if _libc is None:
+            _libc = ctypes.CDLL(None, use_errno=True)
+    return _libc
+
+
+def lower_thread_io_priority():
+    """
+    Give the calling thread the lowest best-effort I/O priority, so its disk access yields to
+    image generation and model loading. Linux only, does nothing elsewhere. It can't be raised
+    again without privileges, so only call it from threads that end with their job.
+    """
+    syscall = _IOPRIO_SET_SYSCALLS.get(platform.machine().lower())
+    if syscall is None or not platform.system() == "Linux":
+        return False
+    try:
+        # who=0 is the calling thread, I/O priorities are per thread on Linux
+        return _get_libc().syscall(syscall, _IOPRIO_WHO_PROCESS, 0, _IOPRIO_LOWEST_BE) == 0
+    except (OSError, AttributeError):
+        return False
+
+
+def drop_page_cache(fd, offset=0, length=0, flush=False):
+    """
+    Tell the kernel the pages of `fd` in [offset, offset + length) won't be needed again
+    (length 0 means to the end of the file), so they don't push other files out of the page
+    cache. Dirty pages can't be dropped, pass flush=True for a file that was written to.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        if flush:
+            os.fdatasync(fd)
+        os.posix_fadvise(fd, offset, length, os.POSIX_FADV_DONTNEED)
+    except OSError:
+        pass
+
+
+def page_cache_usage():
+    """Bytes in the page cache ("Cached" in /proc/meminfo), None where that isn't available."""
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                key, value = line.split(":", 1)
+                if key == "Cached":
+                    return int(value.split()[0]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
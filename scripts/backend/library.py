@@ -0,0 +1,290 @@
+import os
+import json
+import time
+import threading
+from .utils import get_model_folders, get_extension_data_path
+
+MODEL_EXTENSIONS = ('.safetensors', '.ckpt', '.pt')
+PREVIEW_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+# Files next to a model named <model base><suffix>, and the key they are listed under
+SIDECAR_SUFFIXES = {
+    '.metadata.json': 'metadata',
+    '.json': 'info',
+    '.civitai.info': 'civitai_info',
+    '.sha256': 'sha256',
+}
+for _ext in PREVIEW_EXTENSIONS:
+    SIDECAR_SUFFIXES['.preview' + _ext] = 'preview'
+
+# Model types the info tools don't handle
+SKIP_TYPES = {"Controlnet", "Upscaler", "VAE"}
+
+# A directory listing is only reused if the directory hadn't changed for this long when it was
+# listed, since filesystems with coarse mtimes could hide a change made in the same tick.
+MTIME_SAFETY_NS = 2 * 1000 ** 3
+
+
+class ModelEntry:
+    """A model file and the sidecar files found next to it."""
+
+    __slots__ = ('root', 'filename', 'sidecars')
+
+    def __init__(self, root, filename, sidecars=None):
+        self.root = root
+        self.filename = filename
+        self.sidecars = sidecars or {}
+
+    @property
+    def path(self):
+        return os.path.join(self.root, self.filename)
+
+    @property
+    def base(self):
+        return os.path.splitext(self.filename)[0]
+
+    @property
+    def metadata_path(self):
+        return self.sidecars.get('metadata')
+
+    @property
+    def preview_path(self):
+        return self.sidecars.get('preview')
+
+    def missing(self):
+        """Which of 'metadata' and 'preview' this model lacks."""
+        missing = []
+        if 'metadata' not in self.sidecars:
+            missing.append('metadata')
+        if 'preview' not in self.sidecars:
+            missing.append('preview')
+        return missing
+
+
+def get_library_folders(skip_types=SKIP_TYPES):
+    """Unique absolute model folders that exist, so no folder is scanned twice."""
+    unique_folders = set()
+    for model_type, folder in get_model_folders().items():
+        if model_type in skip_types:
+            continue
+        abs_folder = os.path.abspath(folder)
+        if os.path.isdir(abs_folder):
+            unique_folders.add(abs_folder)
+    return sorted(unique_folders)
+
+
+def group_directory(root, names):
+    """Group the file names of one directory into ModelEntry objects with their sidecars."""
+    lower_names = {name.lower(): name for name in names}
+    entries = []
+    for name in names:
+        if not name.lower().endswith(MODEL_EXTENSIONS):
+            continue
+        base = os.path.splitext(name)[0].lower()
+        sidecars = {}
+        for suffix, kind in SIDECAR_SUFFIXES.items():
+            found = lower_names.get(base + suffix)
+            if found and kind not in sidecars:
+                sidecars[kind] = os.path.join(root, found)
+        entries.append(ModelEntry(root, name, sidecars))
+    return entries
+
+
+class ScanManifest:
+    """
+    Persisted listing of every scanned directory: its mtime, file names and subdirectory names.
+    Adding, removing or renaming an entry changes a directory's mtime, so a directory whose mtime
+    didn't move can reuse its recorded listing instead of being listed again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.dirs = None
+        self.changed = False
+
+    def load(self):
+        if self.dirs is not None:
+            return
+        self.dirs = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.dirs = json.load(f).get('dirs', {})
+            except Exception as e:
+                print(f"Failed to read scan manifest, rescanning everything: {e}")
+
+    def get(self, root, mtime_ns):
+        """Recorded (files, subdirs) of `root` if it didn't change since, else None."""
+        entry = self.dirs.get(root)
+        if not entry or entry['mtime_ns'] != mtime_ns:
+            return None
+        if entry['scanned_ns'] - mtime_ns < MTIME_SAFETY_NS:
+            return None
+        return entry['files'], entry['subdirs']
+
+    def put(self, root, mtime_ns, files, subdirs):
+        self.dirs[root] = {
+            'mtime_ns': mtime_ns,
+            'scanned_ns': time.time_ns(),
+            'files': files,
+            'subdirs': subdirs,
+        }
+        self.changed = True
+
+    def forget_missing(self, folders, visited):
+        """Drop directories under `folders` that weren't seen in the last scan."""
+        prefixes = tuple(os.path.join(folder, '') for folder in folders)
+        for root in list(self.dirs):
+            if root not in visited and (root in folders or root.startswith(prefixes)):
+                del self.dirs[root]
+                self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'dirs': self.dirs}, f)
+            os.replace(tmp_path, self.path)
+            self.changed = False
+        except Exception as e:
+            print(f"Failed to save scan manifest: {e}")
+
+
+def list_directory(root):
+    """(file names, subdirectory names) of `root`, not following directory symlinks like os.walk."""
+    files = []
+    subdirs = []
+    with os.scandir(root) as it:
+        for entry in it:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                elif entry.is_file():
+                    files.append(entry.name)
+            except OSError:
+                continue
+    return files, subdirs
+
+
+def scan_folder(folder, manifest=None, visited=None):
+    """
+    Walk `folder` once with os.scandir and yield (root, entries) for every directory holding
+    model files. With a manifest, unchanged directories cost a single stat instead of a listing.
+    """
+    stack = [folder]
+    while stack:
+        root = stack.pop()
+        try:
+            cached = None
+            if manifest is not None:
+                mtime_ns = os.stat(root).st_mtime_ns
+                cached = manifest.get(root, mtime_ns)
+            if cached:
+                files, subdirs = cached
+            else:
+                files, subdirs = list_directory(root)
+                if manifest is not None:
+                    manifest.put(root, mtime_ns, files, subdirs)
+        except OSError as e:
+            print(f"Failed to scan {root}: {e}")
+            continue
+        if visited is not None:
+            visited.add(root)
+        stack.extend(os.path.join(root, name) for name in subdirs)
+        entries = group_directory(root, files)
+        if entries:
+            yield root, entries
+
+
+class LibraryIndex:
+    """In-memory index of every model in the library and its sidecar files."""
+
+    def __init__(self, folders):
+        self.folders = folders
+        self.models = {}
+        self.sidecars = {}  # sidecar path -> model path
+        self._lock = threading.Lock()
+
+    def add_directory(self, root, entries):
+        with self._lock:
+            for entry in entries:
+                self.models[entry.path] = entry
+                for sidecar in entry.sidecars.values():
+                    self.sidecars[sidecar] = entry.path
+
+    def remove_tree(self, root):
+        """Forget every model in `root` and its subdirectories."""
+        prefix = os.path.join(root, '')
+        with self._lock:
+            for path in [p for p, e in self.models.items() if e.root == root or e.root.startswith(prefix)]:
+                entry = self.models.pop(path)
+                for sidecar in entry.sidecars.values():
+                    self.sidecars.pop(sidecar, None)
+
+    def get(self, path):
+        return self.models.get(path)
+
+    def has_file(self, path):
+        """True if `path` is a known model or sidecar file."""
+        return path in self.models or path in self.sidecars
+
+    def __iter__(self):
+        with self._lock:
+            entries = [self.models[path] for path in sorted(self.models)]
+        return iter(entries)
+
+    def __len__(self):
+        return len(self.models)
+
+    def with_metadata(self):
+        return [entry for entry in self if entry.metadata_path]
+
+    def missing_info(self):
+        """Models lacking metadata or a preview, as (entry, missing) pairs."""
+        result = []
+        for entry in self:
+            missing = entry.missing()
+            if missing:
+                result.append((entry, missing))
+        return result
+
+
+scan_manifest = ScanManifest(get_extension_data_path("library_manifest.json"))
+_scan_lock = threading.Lock()
+
+
+def scan_library(folders=None, incremental=True):
+    """
+    Scan the model folders once and return the library index. Incremental scans only list
+    directories whose mtime moved since the last scan and reuse the manifest for the rest.
+    """
+    folders = folders if folders is not None else get_library_folders()
+    library = LibraryIndex(folders)
+    if not incremental:
+        for folder in folders:
+            for root, entries in scan_folder(folder):
+                library.add_directory(root, entries)
+        return library
+    with _scan_lock:
+        scan_manifest.load()
+        visited = set()
+        for folder in folders:
+            for root, entries in scan_folder(folder, scan_manifest, visited):
+                library.add_directory(root, entries)
+        scan_manifest.forget_missing(folders, visited)
+        scan_manifest.save()
+    return library
+
+
+def rescan_directory(library, root):
+    """Refresh `library` for `root` and everything below it, e.g. after a change was reported there."""
+    with _scan_lock:
+        scan_manifest.load()
+        visited = set()
+        found = list(scan_folder(root, scan_manifest, visited)) if os.path.isdir(root) else []
+        library.remove_tree(root)
+        for directory, entries in found:
+            library.add_directory(directory, entries)
+        scan_manifest.forget_missing([root], visited)
+        scan_manifest.save()
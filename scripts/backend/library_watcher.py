@@ -0,0 +1,173 @@
+import os
+import time
+import threading
+from .library import scan_library, rescan_directory, get_library_folders, MODEL_EXTENSIONS, SIDECAR_SUFFIXES
+
+try:
+    # Uses inotify on Linux, and the native APIs on Windows and macOS
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+# Wait for this long without new events before refreshing, so big copies don't cause a refresh per file
+DEBOUNCE_SECONDS = 2.0
+# But never hold back a refresh for longer than this while events keep coming
+MAX_DELAY_SECONDS = 30.0
+# Rescan interval when watchdog isn't installed, cheap thanks to the scan manifest
+POLL_INTERVAL_SECONDS = 60.0
+
+_RELEVANT_SUFFIXES = tuple(MODEL_EXTENSIONS) + tuple(SIDECAR_SUFFIXES)
+# Downloads in progress and their resume sidecars, rewritten constantly while downloading.
+# ".part.json" has to be listed, ".json" sidecars would match it otherwise.
+_IGNORED_SUFFIXES = (".part", ".part.json", ".tmp")
+
+
+def _is_relevant(path, is_directory):
+    if is_directory:
+        return True
+    path = path.lower()
+    return path.endswith(_RELEVANT_SUFFIXES) and not path.endswith(_IGNORED_SUFFIXES)
+
+
+class _EventHandler(FileSystemEventHandler):
+    def __init__(self, watcher):
+        self.watcher = watcher
+
+    def on_any_event(self, event):
+        if event.event_type not in ("created", "deleted", "moved"):
+            return
+        for path in (event.src_path, getattr(event, "dest_path", None)):
+            if path and _is_relevant(path, event.is_directory):
+                # A change to an entry always shows up in the listing of its parent
+                self.watcher.mark_dirty(os.path.dirname(path))
+
+
+class LibraryWatcher:
+    """
+    Keeps an in-memory library index up to date in the background, so the info tools and the
+    card endpoints can use it without scanning the disk. Uses watchdog (inotify on Linux) when it
+    is installed, otherwise rescans incrementally every POLL_INTERVAL_SECONDS.
+    """
+
+    def __init__(self):
+        self.library = None
+        self.folders = []
+        self.mode = None
+        self._observer = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._dirty = set()
+        self._first_event = None
+        self._last_event = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self._thread is not None and self._stop.is_set():
+            # Let a watcher that is still shutting down finish first
+            self._thread.join(2)
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._observer is not None:
+            try:
+                self._observer.stop()
+            except Exception:
+                pass
+            self._observer = None
+        self.library = None
+
+    def mark_dirty(self, directory):
+        now = time.time()
+        with self._lock:
+            self._dirty.add(directory)
+            if self._first_event is None:
+                self._first_event = now
+            self._last_event = now
+
+    def _take_dirty(self):
+        """The dirty directories once things settled down, without the ones inside another dirty one."""
+        now = time.time()
+        with self._lock:
+            if not self._dirty:
+                return []
+            if now - self._last_event < DEBOUNCE_SECONDS and now - self._first_event < MAX_DELAY_SECONDS:
+                return []
+            dirty = sorted(self._dirty)
+            self._dirty.clear()
+            self._first_event = self._last_event = None
+        roots = []
+        for directory in dirty:
+            if not any(directory.startswith(os.path.join(root, "")) for root in roots):
+                roots.append(directory)
+        return roots
+
+    def _run(self):
+        try:
+            self.folders = get_library_folders()
+            self.library = scan_library(self.folders)
+            if Observer is not None:
+                self._observer = Observer()
+                handler = _EventHandler(self)
+                for folder in self.folders:
+                    self._observer.schedule(handler, folder, recursive=True)
+                self._observer.start()
+                self.mode = "watch"
+            else:
+                self.mode = "poll"
+            print(f"Model library watcher started ({self.mode}), {len(self.library)} models indexed")
+        except Exception as e:
+            print(f"Failed to start the model library watcher: {e}")
+            self.library = None
+            return
+
+        last_poll = time.time()
+        while not self._stop.wait(0.5):
+            try:
+                if self.mode == "poll":
+                    if time.time() - last_poll >= POLL_INTERVAL_SECONDS:
+                        self.library = scan_library(self.folders)
+                        last_poll = time.time()
+                    continue
+                for directory in self._take_dirty():
+                    rescan_directory(self.library, directory)
+            except Exception as e:
+                print(f"Model library watcher failed to refresh: {e}")
+
+
+library_watcher = LibraryWatcher()
+
+
+def get_hot_library():
+    """The watcher's library index if it is running, without touching the disk, else None."""
+    if library_watcher.running:
+        return library_watcher.library
+    return None
+
+
+def get_library():
+    """The library index, from the watcher when it's on, otherwise from a fresh (incremental) scan."""
+    library = get_hot_library()
+    return library if library is not None else scan_library()
+
+
+def apply_watch_setting(enabled):
+    if enabled:
+        library_watcher.start()
+    else:
+        library_watcher.stop()
+
+
+def on_app_started(demo, app):
+    from modules import shared
+    apply_watch_setting(getattr(shared.opts, "civitai_watch_library", False))
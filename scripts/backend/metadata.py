@@ -1,21 +1,167 @@
 from fastapi import APIRouter, Request, HTTPException
+from starlette.concurrency import run_in_threadpool
 import os
 import json
+import threading
+from collections import OrderedDict
+from .library_watcher import get_hot_library
 
 router = APIRouter()
 
+# Fields the batch endpoint can return for each metadata file
+SUMMARY_FIELDS = ('id', 'name', 'type', 'versionId', 'baseModel', 'trainedWords')
+MAX_BATCH_PATHS = 5000
+# Summaries are a few hundred bytes, so this keeps a large library in memory for a few MB
+SUMMARY_CACHE_SIZE = 10000
+
+
+def is_allowed_metadata_path(path):
+    # Security: Only allow access to .metadata.json files in models/
+    return path.endswith('.metadata.json') and '..' not in path and path.startswith('models/')
+
+
+def summarize_metadata(data):
+    """The few fields the model cards need out of a full .metadata.json."""
+    civitai = data.get('civitai') or {}  # Civitai Helper format
+    versions = data.get('modelVersions') or []
+    version = versions[0] if versions else civitai
+    return {
+        'id': civitai.get('modelId') or civitai.get('id') or data.get('id'),
+        'name': data.get('name'),
+        'type': data.get('type'),
+        'versionId': version.get('id'),
+        'baseModel': version.get('baseModel'),
+        'trainedWords': version.get('trainedWords') or [],
+    }
+
+
+class SummaryCache:
+    """LRU cache of metadata summaries by absolute path, an entry is dropped once the file's mtime or size changes."""
+
+    def __init__(self, max_size=SUMMARY_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()  # path -> (mtime_ns, size, summary)
+        self._lock = threading.Lock()
+
+    def get(self, path, st):
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None:
+                return None
+            if entry[0] != st.st_mtime_ns or entry[1] != st.st_size:
+                del self._entries[path]
+                return None
+            self._entries.move_to_end(path)
+            return entry[2]
+
+    def put(self, path, st, summary):
+        with self._lock:
+            self._entries[path] = (st.st_mtime_ns, st.st_size, summary)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, path):
+        with self._lock:
+            self._entries.pop(path, None)
+
+
+summary_cache = SummaryCache()
+
+
+def read_summary(path):
+    """Summary of the metadata file at `path` (relative to the WebUI folder), None if missing or unreadable."""
+    abs_path = os.path.abspath(path)
+    try:
+        st = os.stat(abs_path)
+    except OSError:
+        summary_cache.invalidate(abs_path)
+        return None
+    summary = summary_cache.get(abs_path, st)
+    if summary is None:
+        try:
+            with open(abs_path, 'r', encoding='utf-8') as f:
+                summary = summarize_metadata(json.load(f))
+        except (OSError, ValueError):
+            return None
+        summary_cache.put(abs_path, st, summary)
+    return summary
+
+
+def list_metadata_files(folder):
+    """Every .metadata.json below `folder`, as forward-slash paths relative to the WebUI folder."""
+    paths = []
+    for root, dirs, files in os.walk(folder):
+        for file in files:
+            if file.endswith('.metadata.json'):
+                paths.append(os.path.join(root, file).replace('\\', '/'))
+    return paths
+
+
+def read_metadata(abs_path):
+    with open(abs_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def read_summaries(paths, fields):
+    results = {}
+    for path in paths:
+        summary = read_summary(path)
+        results[path] = {k: summary[k] for k in fields} if summary else None
+    return results
+
+
 @router.get('/sd-webui-model-downloader/api/metadata')
 async def get_metadata(path: str):
-    # Security: Only allow access to .metadata.json files in models/
-    if not path.endswith('.metadata.json') or '..' in path or not path.startswith('models/'):
+    if not is_allowed_metadata_path(path):
         raise HTTPException(status_code=403, detail="Forbidden")
     abs_path = os.path.abspath(path)
-    if not os.path.exists(abs_path):
+    # A sidecar in the live library index needs no trip to the disk. The index can't vouch for
+    # a missing file though: the scan doesn't follow symlinked subfolders and may be a moment behind
+    library = get_hot_library()
+    if (library is None or not library.has_file(abs_path)) and not os.path.exists(abs_path):
         raise HTTPException(status_code=404, detail="File not found")
-    with open(abs_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    return data
+    # Parse in a worker thread, a big file would otherwise hold up every other request
+    return await run_in_threadpool(read_metadata, abs_path)
+
+
+@router.get('/sd-webui-model-downloader/api/metadata/summary')
+async def get_metadata_summary(path: str):
+    """Cached summary of one metadata file, see summarize_metadata."""
+    if not is_allowed_metadata_path(path):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    summary = await run_in_threadpool(read_summary, path)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    return summary
+
+
+@router.post('/sd-webui-model-downloader/api/metadata/batch')
+async def get_metadata_batch(request: Request):
+    """
+    Summaries of many metadata files in one request, for rendering model cards.
+    Body: {"paths": [...]} or {"folder": "models/Lora"}, plus optional "fields" out of SUMMARY_FIELDS.
+    Returns {"results": {path: {field: value} or null}}.
+    """
+    data = await request.json()
+    fields = [f for f in (data.get('fields') or SUMMARY_FIELDS) if f in SUMMARY_FIELDS]
+    folder = data.get('folder')
+    if folder:
+        folder = folder.replace('\\', '/').rstrip('/')
+        if '..' in folder or not (folder == 'models' or folder.startswith('models/')):
+            raise HTTPException(status_code=403, detail="Forbidden")
+        paths = await run_in_threadpool(list_metadata_files, folder)
+    else:
+        paths = data.get('paths') or []
+        if not isinstance(paths, list) or not all(isinstance(p, str) for p in paths):
+            raise HTTPException(status_code=400, detail="paths must be a list of strings")
+        if any(not is_allowed_metadata_path(p) for p in paths):
+            raise HTTPException(status_code=403, detail="Forbidden")
+    if len(paths) > MAX_BATCH_PATHS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_PATHS} paths per request")
+    results = await run_in_threadpool(read_summaries, paths, fields)
+    return {"results": results}
 
 # In your extension's setup code:
 def on_app_started(demo, app):
-    app.include_router(router)
\ No newline at end of file
+    app.include_router(router)
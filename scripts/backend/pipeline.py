@@ -0,0 +1,164 @@
+import queue
+import threading
+import time
+
+# How often blocked workers wake up to check for cancellation
+POLL_SECONDS = 0.2
+_DONE = object()
+
+
+class Stage:
+    """
+    One step of a Pipeline: `func(item)` runs on `workers` threads and returns the item for the
+    next stage, or None when the item is finished. `queue_size` bounds how far this stage may run
+    ahead of the next one.
+
+    With a `batch_size`, `func(items)` gets up to that many items at once, whatever arrived within
+    `batch_wait` seconds, and returns the list of items for the next stage.
+    """
+
+    def __init__(self, name, func, workers=1, queue_size=None, batch_size=None, batch_wait=1.0):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.queue = queue.Queue(maxsize=queue_size or self.workers * 2 * (batch_size or 1))
+        self.active = 0
+        self.done = 0
+        self._alive = self.workers
+
+
+class Pipeline:
+    """
+    Runs items through stages that work concurrently, e.g. hashing the next files while the
+    previous ones are being looked up, connected by bounded queues. An exception in a stage
+    finishes the item and is passed to `on_error(item, stage, exception)`.
+    """
+
+    def __init__(self, stages, on_error=None):
+        self.stages = stages
+        self.on_error = on_error
+        self.total = 0
+        self.finished = 0
+        self._lock = threading.Lock()
+        self._cancel = lambda: False
+
+    def _put(self, q, item):
+        """Blocking put that gives up once the run is cancelled."""
+        while not self._cancel():
+            try:
+                q.put(item, timeout=POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _item_finished(self):
+        with self._lock:
+            self.finished += 1
+
+    def _feed(self, items):
+        first = self.stages[0]
+        for item in items:
+            if not self._put(first.queue, item):
+                return
+        for _ in range(first.workers):
+            self._put(first.queue, _DONE)
+
+    def _get(self, stage, timeout=None):
+        """Next item for `stage`, _DONE when there are no more, None on cancel or timeout."""
+        deadline = time.time() + timeout if timeout is not None else None
+        while not self._cancel():
+            wait = POLL_SECONDS if deadline is None else min(POLL_SECONDS, deadline - time.time())
+            if wait <= 0:
+                return None
+            try:
+                return stage.queue.get(timeout=wait)
+            except queue.Empty:
+                continue
+        return None
+
+    def _get_batch(self, stage):
+        """(items, more) with up to batch_size items, more is False once the stage got _DONE."""
+        item = self._get(stage)
+        if item is None or item is _DONE:
+            return [], False
+        items = [item]
+        deadline = time.time() + stage.batch_wait
+        while len(items) < stage.batch_size:
+            item = self._get(stage, max(0, deadline - time.time()))
+            if item is _DONE:
+                return items, False
+            if item is None:
+                break
+            items.append(item)
+        return items, True
+
+    def _process(self, stage, items):
+        """Run the stage on `items`, return the ones to pass on."""
+        with self._lock:
+            stage.active += len(items)
+        try:
+            if stage.batch_size:
+                results = list(stage.func(items))
+            else:
+                result = stage.func(items[0])
+                results = [result] if result is not None else []
+        except Exception as e:
+            results = []
+            if self.on_error:
+                for item in items:
+                    self.on_error(item, stage, e)
+        with self._lock:
+            stage.active -= len(items)
+            stage.done += len(items)
+            self.finished += len(items) - len(results)
+        return results
+
+    def _work(self, index):
+        stage = self.stages[index]
+        next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+        more = True
+        while more and not self._cancel():
+            if stage.batch_size:
+                items, more = self._get_batch(stage)
+            else:
+                item = self._get(stage)
+                more = item is not _DONE
+                items = [item] if more and item is not None else []
+            if not items:
+                continue
+            for result in self._process(stage, items):
+                if next_stage is None or not self._put(next_stage.queue, result):
+                    self._item_finished()
+        with self._lock:
+            stage._alive -= 1
+            last = stage._alive == 0
+        # The last worker of a stage tells the next stage that nothing more is coming
+        if last and next_stage is not None:
+            for _ in range(next_stage.workers):
+                self._put(next_stage.queue, _DONE)
+
+    def status(self):
+        stages = ', '.join(f"{stage.name}: {stage.done} done, {stage.active} active" for stage in self.stages)
+        return f"{self.finished}/{self.total} files finished ({stages})"
+
+    def run(self, items, is_cancelled=None, interval=0.5):
+        """
+        Generator pushing `items` through every stage, yielding itself about every `interval`
+        seconds so the caller can report status(). Stops early once is_cancelled() returns True.
+        """
+        items = list(items)
+        self.total = len(items)
+        self._cancel = is_cancelled or (lambda: False)
+        threads = [threading.Thread(target=self._feed, args=(items,), daemon=True)]
+        for index, stage in enumerate(self.stages):
+            threads += [threading.Thread(target=self._work, args=(index,), daemon=True) for _ in range(stage.workers)]
+        for thread in threads:
+            thread.start()
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(interval)
+            yield self
+        for thread in threads:
+            thread.join()
@@ -1,26 +1,100 @@
-# Shared process state and cancel flag for all long-running backend operations
+import time
+import itertools
+import threading
 
-PROCESS_STATE = {'running': False, 'type': None}
-CANCEL_FLAG = {'cancel': False}
+# Registry of the long-running backend jobs (library checks), each with its own id and cancel token
 
-def is_running():
-    return PROCESS_STATE['running']
+# Jobs of one type allowed at once, unless start() is given a limit
+DEFAULT_LIMIT = 1
 
-def get_type():
-    return PROCESS_STATE['type']
 
-def set_running(process_type):
-    PROCESS_STATE['running'] = True
-    PROCESS_STATE['type'] = process_type
-    CANCEL_FLAG['cancel'] = False
+class CancelToken:
+    """Set once to ask a job to stop. Jobs poll is_cancelled(), it can be passed on as a callable."""
 
-def clear_running():
-    PROCESS_STATE['running'] = False
-    PROCESS_STATE['type'] = None
-    CANCEL_FLAG['cancel'] = False
+    def __init__(self):
+        self._event = threading.Event()
 
-def cancel_process():
-    CANCEL_FLAG['cancel'] = True
+    def cancel(self):
+        self._event.set()
 
-def is_cancelled():
-    return CANCEL_FLAG['cancel']
+    def is_cancelled(self):
+        return self._event.is_set()
+
+
+class Job:
+    def __init__(self, job_id, job_type, owner=None):
+        self.id = job_id
+        self.type = job_type
+        # Who started the job, e.g. "ui" or "api", so each side only stops its own jobs
+        self.owner = owner
+        self.token = CancelToken()
+        self.started_at = time.time()
+        # The job's ResultSink, for jobs that produce a list of results
+        self.results = None
+
+    def cancel(self):
+        self.token.cancel()
+
+    def is_cancelled(self):
+        return self.token.is_cancelled()
+
+
+class JobRegistry:
+    """
+    The running jobs by id. Jobs of different types run side by side, the caller passes each
+    type's concurrency limit to start(), and cancelling a job only sets that job's token.
+    """
+
+    def __init__(self):
+        self._jobs = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def start(self, job_type, owner=None, limit=None):
+        """Register a new running job, or return None while `limit` jobs of its type are running."""
+        with self._lock:
+            if limit is None:
+                limit = DEFAULT_LIMIT
+            running = sum(1 for job in self._jobs.values() if job.type == job_type)
+            if running >= limit:
+                return None
+            job = Job(next(self._ids), job_type, owner)
+            self._jobs[job.id] = job
+            return job
+
+    def finish(self, job):
+        """Remove a job that ended, cancelled or not. Finishing it twice does nothing."""
+        with self._lock:
+            self._jobs.pop(job.id, None)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def running(self, job_type=None, owner=None):
+        """Running jobs, optionally only those of one type or owner, oldest first."""
+        with self._lock:
+            return [
+                job for job in self._jobs.values()
+                if (job_type is None or job.type == job_type) and (owner is None or job.owner == owner)
+            ]
+
+    def is_running(self, job_type=None, owner=None):
+        return bool(self.running(job_type, owner))
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is None:
+            return False
+        job.cancel()
+        return True
+
+    def cancel_all(self, job_type=None, owner=None):
+        """Cancel the matching running jobs, returns how many."""
+        jobs = self.running(job_type, owner)
+        for job in jobs:
+            job.cancel()
+        return len(jobs)
+
+
+job_registry = JobRegistry()
@@ -0,0 +1,132 @@
+import time
+import threading
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from .domain_health import CIVITAI_DOMAINS
+
+# Requests per second: where the limiter starts, and the range it adapts within
+INITIAL_RATE = 5.0
+MIN_RATE = 0.2
+MAX_RATE = 10.0
+# Added to the rate after every successful request, the rate is halved on a 429
+RATE_STEP = 0.1
+BURST = 5
+# Requests allowed in flight at once, adapted the same way
+INITIAL_CONCURRENCY = 4
+MAX_CONCURRENCY = 8
+# Successful requests needed before one more may run at once
+CONCURRENCY_STEP_SUCCESSES = 20
+# Pause after a 429 without Retry-After, doubled for each 429 in a row
+DEFAULT_PAUSE = 5.0
+MAX_PAUSE = 120.0
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (delay in seconds or an HTTP date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """
+    Token bucket with adaptive concurrency in front of every Civitai API request (file
+    downloads aren't limited). A 429 halves the rate and the concurrency and pauses all API
+    requests for the Retry-After time; every success raises the rate again, so batch jobs settle
+    at what the server allows instead of losing entries to 429s.
+    """
+
+    def __init__(self):
+        self.rate = INITIAL_RATE
+        self.concurrency = INITIAL_CONCURRENCY
+        self.tokens = float(BURST)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.throttled = 0
+        self._successes = 0
+        self._consecutive_429 = 0
+        self._last_refill = time.monotonic()
+        self._cond = threading.Condition()
+
+    @staticmethod
+    def applies_to(url):
+        parsed = urlparse(url)
+        return (
+            parsed.hostname in CIVITAI_DOMAINS
+            and parsed.path.startswith("/api/")
+            and not parsed.path.startswith("/api/download/")
+        )
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(BURST, self.tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        with self._cond:
+            while True:
+                self._refill()
+                pause = self.paused_until - time.monotonic()
+                if pause > 0:
+                    self._cond.wait(pause)
+                elif self.in_flight >= self.concurrency:
+                    self._cond.wait()
+                elif self.tokens < 1:
+                    self._cond.wait((1 - self.tokens) / self.rate)
+                else:
+                    self.tokens -= 1
+                    self.in_flight += 1
+                    return
+
+    def release(self, throttled=False, retry_after=None, failed=False):
+        """
+        Report how the request went: throttled=True for a 429, with its Retry-After header,
+        failed=True when no response came back at all.
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if failed:
+                pass
+            elif throttled:
+                self.throttled += 1
+                self._consecutive_429 += 1
+                self._successes = 0
+                self.rate = max(MIN_RATE, self.rate / 2)
+                self.concurrency = max(1, self.concurrency // 2)
+                pause = parse_retry_after(retry_after)
+                if pause is None:
+                    pause = min(MAX_PAUSE, DEFAULT_PAUSE * 2 ** (self._consecutive_429 - 1))
+                self.paused_until = max(self.paused_until, time.monotonic() + pause)
+                self.tokens = 0.0
+                print(f"Civitai API rate limit hit, pausing {pause:.0f}s. {self._describe()}")
+            else:
+                self._consecutive_429 = 0
+                self._successes += 1
+                self.rate = min(MAX_RATE, self.rate + RATE_STEP)
+                if self._successes >= CONCURRENCY_STEP_SUCCESSES:
+                    self._successes = 0
+                    self.concurrency = min(MAX_CONCURRENCY, self.concurrency + 1)
+            self._cond.notify_all()
+
+    def _describe(self):
+        pause = self.paused_until - time.monotonic()
+        state = f"paused for {pause:.0f}s" if pause > 0 else "running"
+        return f"API rate limit: {state}, {self.rate:.1f} requests/s, {self.concurrency} at once, {self.throttled} times throttled"
+
+    def describe(self):
+        """Throttle state for the tools' output, empty while the limiter never slowed anything down."""
+        with self._cond:
+            if not self.throttled:
+                return ""
+            return self._describe()
+
+
+rate_limiter = RateLimiter()
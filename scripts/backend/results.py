@@ -0,0 +1,123 @@
+import os
+import time
+import threading
+from collections import deque, OrderedDict
+from .utils import get_extension_data_path
+
+FIXED = "fixed"
+SKIPPED = "skipped"
+FAILED = "failed"
+UPDATE = "updates"
+CATEGORIES = (FIXED, SKIPPED, FAILED, UPDATE)
+
+# Newest results shown in the scan output, older ones are in the results table and the log
+RESULT_WINDOW = 30
+RESULTS_PAGE_SIZE = 50
+LOG_DIR = get_extension_data_path("logs")
+# Scan logs kept on disk, the oldest are deleted
+MAX_LOG_FILES = 20
+
+_latest = None
+_latest_lock = threading.Lock()
+
+
+def get_latest_results():
+    """The sink of the most recently started scan, None before the first one."""
+    return _latest
+
+
+def prune_logs(log_dir=LOG_DIR, keep=MAX_LOG_FILES):
+    try:
+        logs = sorted(
+            (os.path.join(log_dir, name) for name in os.listdir(log_dir) if name.endswith(".log")),
+            key=os.path.getmtime,
+        )
+    except OSError:
+        return
+    for path in logs[:-keep]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class ResultSink:
+    """
+    Collects the results of one scan as they come in. Rendering only covers the counts and the
+    last RESULT_WINDOW results, so each progress update stays the same size however long the
+    scan runs; every result stays available page by page and in a log file.
+    """
+
+    def __init__(self, kind, job_id=None, log_dir=LOG_DIR):
+        global _latest
+        self.kind = kind
+        self.results = []
+        self.window = deque(maxlen=RESULT_WINDOW)
+        self.counts = OrderedDict((category, 0) for category in CATEGORIES)
+        self.log_path = None
+        self._log = None
+        self._lock = threading.Lock()
+        try:
+            os.makedirs(log_dir, exist_ok=True)
+            prune_logs(log_dir, MAX_LOG_FILES - 1)
+            suffix = f"-{job_id}" if job_id is not None else ""
+            self.log_path = os.path.join(log_dir, f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}{suffix}.log")
+            self._log = open(self.log_path, "a", encoding="utf-8")
+        except OSError as e:
+            print(f"Could not open the scan log: {e}")
+            self.log_path = None
+        with _latest_lock:
+            _latest = self
+
+    def add(self, category, message, file=""):
+        """Record one result, a line in the output window and the log."""
+        with self._lock:
+            self.results.append((category, file, message))
+            self.window.append(message)
+            self.counts[category] = self.counts.get(category, 0) + 1
+            if self._log:
+                self._log.write(f"{time.strftime('%H:%M:%S')}\t{category}\t{file}\t{message}\n")
+                self._log.flush()
+
+    def close(self):
+        with self._lock:
+            if self._log:
+                self._log.close()
+                self._log = None
+
+    def summary(self):
+        return ", ".join(f"{category.capitalize()}: {count}" for category, count in self.counts.items() if count)
+
+    def render(self, *status):
+        """Markdown with the counts, the newest results and `status` lines, bounded in size."""
+        with self._lock:
+            window = list(self.window)
+            hidden = len(self.results) - len(window)
+            summary = self.summary()
+        lines = []
+        if summary:
+            lines.append(f"**Results:** {summary}")
+        if hidden:
+            lines.append(f"... {hidden} earlier result(s) in the results table and the log")
+        lines += window
+        lines += [line for line in status if line]
+        if self.log_path and summary:
+            lines.append(f"Full log: `{self.log_path}`")
+        return "\n\n".join(lines)
+
+    def page(self, category=None, query="", page=1, page_size=RESULTS_PAGE_SIZE):
+        """
+        One page of results as (category, file, message) rows, optionally only of one category
+        or containing `query`. Returns (rows, matching results, number of pages).
+        """
+        query = (query or "").lower()
+        with self._lock:
+            matches = [
+                row for row in self.results
+                if (not category or row[0] == category)
+                and (not query or query in row[1].lower() or query in row[2].lower())
+            ]
+        pages = max(1, -(-len(matches) // page_size))
+        page = min(max(1, int(page or 1)), pages)
+        start = (page - 1) * page_size
+        return matches[start:start + page_size], len(matches), pages
@@ -0,0 +1,131 @@
+import time
+import threading
+from .check_missing_info import check_missing_info
+from .check_model_updates import check_model_updates
+from .process_control import job_registry
+from .utils import get_max_concurrent_checks
+from .api_cache import prune_api_cache
+
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+# The generators the UI's Info Tools buttons run, by scan type
+SCAN_TYPES = {
+    "missing_info": check_missing_info,
+    "updates": check_model_updates,
+}
+SCAN_NAMES = {
+    "missing_info": "A missing-info check",
+    "updates": "An update check",
+}
+# Finished scans kept for the job list
+MAX_FINISHED_SCANS = 20
+
+
+def start_scan_job(scan_type, owner=None):
+    """Register a scan in the job registry, None while the limit for its type is reached."""
+    return job_registry.start(scan_type, owner=owner, limit=get_max_concurrent_checks(scan_type))
+
+
+def run_scan(scan_type, job):
+    """Run a registered scan, yielding its output, and remove it from the registry at the end."""
+    try:
+        yield from SCAN_TYPES[scan_type](job)
+    finally:
+        job_registry.finish(job)
+        # Checks are what fill the API cache
+        prune_api_cache()
+
+
+def busy_message(scan_type):
+    return f"{SCAN_NAMES[scan_type]} is already running."
+
+
+class ScanJob:
+    """A missing-info or update check running in the background, with its latest output."""
+
+    def __init__(self, job):
+        self.job = job
+        self.id = job.id
+        self.type = job.type
+        self.state = RUNNING
+        self.message = "Starting..."
+        self.started_at = job.started_at
+        self.finished_at = None
+
+    def to_dict(self):
+        end = self.finished_at or time.time()
+        results = self.job.results
+        return {
+            "id": self.id,
+            "kind": "scan",
+            "type": self.type,
+            "state": self.state,
+            "message": self.message,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed": end - self.started_at,
+            "counts": dict(results.counts) if results else {},
+            "log": results.log_path if results else None,
+        }
+
+
+class ScanRunner:
+    """
+    Runs the same scans as the Info Tools buttons on a background thread, for callers without
+    a browser. Scan ids are their job registry ids.
+    """
+
+    def __init__(self):
+        self.scans = []
+        self._lock = threading.Lock()
+
+    def start(self, scan_type, owner="api"):
+        """Start a scan, raises ValueError for an unknown type and RuntimeError at the type's limit."""
+        if scan_type not in SCAN_TYPES:
+            raise ValueError(f"Unknown scan type: {scan_type}")
+        job = start_scan_job(scan_type, owner)
+        if job is None:
+            raise RuntimeError(busy_message(scan_type))
+        scan = ScanJob(job)
+        with self._lock:
+            self.scans.append(scan)
+            finished = [s for s in self.scans if s.state != RUNNING]
+            for old in finished[:-MAX_FINISHED_SCANS]:
+                self.scans.remove(old)
+        threading.Thread(target=self._run, args=(scan,), daemon=True).start()
+        return scan
+
+    def _run(self, scan):
+        try:
+            for message in run_scan(scan.type, scan.job):
+                scan.message = message
+            scan.state = CANCELLED if scan.job.is_cancelled() else DONE
+        except Exception as e:
+            scan.message = f"Error: {str(e)}"
+            scan.state = FAILED
+        scan.finished_at = time.time()
+        print(f"[scan #{scan.id}] {scan.type} {scan.state}")
+
+    def get(self, scan_id):
+        with self._lock:
+            for scan in self.scans:
+                if scan.id == scan_id:
+                    return scan
+        return None
+
+    def list(self):
+        with self._lock:
+            return list(self.scans)
+
+    def cancel(self, scan_id):
+        scan = self.get(scan_id)
+        if not scan or scan.state != RUNNING:
+            return False
+        scan.job.cancel()
+        return True
+
+
+scan_runner = ScanRunner()
@@ -1,10 +1,19 @@
 import os
 import re
 import json
-import requests
+import time
+from . import http_client
+from .domain_health import domain_health
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from urllib.parse import urlparse, parse_qs
 from modules import shared
 
+EXTENSION_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def get_extension_data_path(filename):
+    """Path of a file the extension keeps its own state in, inside the extension folder."""
+    return os.path.join(EXTENSION_DIR, filename)
+
 def get_model_folders():
     return {
         "Checkpoint": os.path.join("models", "Stable-diffusion"),
@@ -23,34 +32,165 @@ def get_model_folders():
 def get_civitai_api_key():
     return getattr(shared.opts, "civitai_api_key", "")
 
+def get_download_connections():
+    """Number of parallel connections used per file, 1 disables segmented downloads."""
+    try:
+        return max(1, int(getattr(shared.opts, "civitai_download_connections", 4)))
+    except (TypeError, ValueError):
+        return 1
+
+def get_max_concurrent_downloads():
+    """How many downloads may run at the same time."""
+    try:
+        return max(1, int(getattr(shared.opts, "civitai_max_concurrent_downloads", 2)))
+    except (TypeError, ValueError):
+        return 1
+
+# The setting holding each library check's concurrency limit, by scan type
+CONCURRENT_CHECK_OPTIONS = {
+    "missing_info": "civitai_max_concurrent_missing_info_checks",
+    "updates": "civitai_max_concurrent_update_checks",
+}
+
+def get_max_concurrent_checks(scan_type):
+    """How many library checks of `scan_type` may run at the same time."""
+    try:
+        return max(1, int(getattr(shared.opts, CONCURRENT_CHECK_OPTIONS[scan_type], 1)))
+    except (KeyError, TypeError, ValueError):
+        return 1
+
+def _get_speed_limit(option):
+    try:
+        return max(0, int(float(getattr(shared.opts, option, 0)) * 1024 * 1024))
+    except (TypeError, ValueError):
+        return 0
+
+def get_download_speed_limit():
+    """Bytes per second all downloads together may use, 0 for no limit."""
+    return _get_speed_limit("civitai_download_speed_limit")
+
+def get_job_speed_limit():
+    """Bytes per second a single download may use, 0 for no limit."""
+    return _get_speed_limit("civitai_job_speed_limit")
+
+def get_low_io_priority():
+    return bool(getattr(shared.opts, "civitai_low_io_priority", False))
+
+def get_api_cache_ttl():
+    """Seconds a cached Civitai API response is used without asking the server again."""
+    try:
+        return max(0, float(getattr(shared.opts, "civitai_api_cache_minutes", 10))) * 60
+    except (TypeError, ValueError):
+        return 0
+
 def get_civitai_domains():
     """Returns [preferred_domain, fallback_domain] based on the user's setting."""
     preferred = getattr(shared.opts, "civitai_preferred_domain", "civitai.red") or "civitai.red"
     if preferred not in ("civitai.com", "civitai.red"):
         preferred = "civitai.red"
     fallback = "civitai.red" if preferred == "civitai.com" else "civitai.com"
-    return [preferred, fallback]
+    # Healthy domains first, the preferred one among them
+    return domain_health.order([preferred, fallback])
 
-def get_civitai_model_info(model_id, api_key=None):
-    headers = {}
-    params = {}
-    if api_key:
-        headers["Authorization"] = f"Bearer {api_key}"
+def get_hedged_requests():
+    return bool(getattr(shared.opts, "civitai_hedged_requests", False))
+
+def format_size(num_bytes):
+    """A byte count in MB, or GB from 1GB up, for progress and log lines."""
+    if num_bytes >= 1024 ** 3:
+        return f"{num_bytes / 1024 ** 3:.1f}GB"
+    return f"{num_bytes / 1024 ** 2:.1f}MB"
+
+_hedge_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="civitai-hedge")
+
+def query_civitai_domains(fetch):
+    """
+    Returns the first result of `fetch(domain)` that isn't None, trying the domains from
+    get_civitai_domains() in order; `fetch` returns None when a domain doesn't have the item.
+    If no domain has it, raises the last error, or returns None if every domain answered.
+
+    With hedged requests on, the next domain is asked as well once the current one is slower
+    than usual, and whichever answers first wins.
+    """
+    domains = get_civitai_domains()
     last_exc = None
-    for domain in get_civitai_domains():
-        try:
-            resp = requests.get(f"https://{domain}/api/v1/models/{model_id}", headers=headers, params=params)
-            if resp.status_code == 404:
+    if not get_hedged_requests():
+        for domain in domains:
+            try:
+                result = fetch(domain)
+            except Exception as e:
+                last_exc = e
                 continue
-            resp.raise_for_status()
-            return resp.json()
-        except Exception as e:
-            last_exc = e
-            continue
+            if result is not None:
+                return result
+        if last_exc:
+            raise last_exc
+        return None
+    pending = set()
+    for i, domain in enumerate(domains):
+        pending.add(_hedge_pool.submit(fetch, domain))
+        is_last = i == len(domains) - 1
+        deadline = None if is_last else time.monotonic() + domain_health.hedge_delay(domain)
+        # Wait for an answer, or until it's time to ask the next domain too
+        while pending:
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    last_exc = e
+                    continue
+                if result is not None:
+                    return result
+            if not done:
+                break
+        # Everything asked so far failed or didn't have it: go straight to the next domain
     if last_exc:
         raise last_exc
     return None
 
+def parse_civitai_model_and_version_id(input_str):
+    if input_str.strip().isdigit():
+        return input_str.strip(), None
+    try:
+        parsed = urlparse(input_str)
+        if parsed.netloc in [
+            "civitai.com",
+            "www.civitai.com",
+            "civitai.red",
+            "www.civitai.red",
+        ]:
+            match = re.match(r"^/models/(\d+)", parsed.path)
+            model_id = match.group(1) if match else None
+            qs = parse_qs(parsed.query)
+            model_version_id = qs.get("modelVersionId", [None])[0]
+            return model_id, model_version_id
+    except Exception:
+        pass
+    match = re.search(r"civitai\.(?:com|red)/models/(\d+)", input_str)
+    model_id = match.group(1) if match else None
+    match_version = re.search(r"modelVersionId=(\d+)", input_str)
+    model_version_id = match_version.group(1) if match_version else None
+    return model_id, model_version_id
+
+def get_civitai_model_info(model_id, api_key=None):
+    # api_cache needs this module, so it can't be imported at the top
+    from .api_cache import api_cache
+    headers = {}
+    params = {}
+    if api_key:
+        headers["Authorization"] = f"Bearer {api_key}"
+
+    def fetch(domain):
+        resp = api_cache.get(f"https://{domain}/api/v1/models/{model_id}", headers=headers, params=params)
+        if resp.status_code == 404:
+            return None
+        resp.raise_for_status()
+        return resp.json()
+
+    return query_civitai_domains(fetch)
+
 def save_model_info_json(folder, filename, model_info, model_version=None):
     """
     Save or update the .json file used by SD WebUI to populate model info.
@@ -139,12 +279,12 @@ def save_preview_and_metadata(folder, filename, model_info, preview_url=None, mo
             ext = ".jpg"
         preview_path = base_path + f".preview{ext}"
         try:
-            resp = requests.get(image_url, stream=True)
-            resp.raise_for_status()
-            with open(preview_path, "wb") as imgf:
-                for chunk in resp.iter_content(chunk_size=8192):
-                    if chunk:
-                        imgf.write(chunk)
+            with http_client.get(image_url, stream=True) as resp:
+                resp.raise_for_status()
+                with open(preview_path, "wb") as imgf:
+                    for chunk in resp.iter_content(chunk_size=8192):
+                        if chunk:
+                            imgf.write(chunk)
         except Exception as e:
             print(f"Failed to download preview image: {e}")
     else:
@@ -0,0 +1,75 @@
+import os
+from .utils import get_model_folders
+
+try:
+    from modules import hashes as webui_hashes, cache as webui_cache
+except ImportError:
+    webui_hashes = webui_cache = None
+
+
+def _is_under(path, folder):
+    folder = os.path.abspath(folder)
+    return os.path.commonpath([path, folder]) == folder
+
+
+def get_cache_titles(file_path):
+    """
+    Titles the WebUI files this model's full SHA256 under in the "hashes" section of cache.json.
+    LoRA safetensors are hashed without their metadata header ("hashes-addnet"), which isn't
+    the file SHA256, so they have no usable title.
+    """
+    path = os.path.abspath(file_path)
+    folders = get_model_folders()
+    stem, ext = os.path.splitext(os.path.basename(path))
+    titles = []
+    try:
+        if _is_under(path, folders["Checkpoint"]):
+            titles.append("checkpoint/" + os.path.relpath(path, os.path.abspath(folders["Checkpoint"])))
+        if _is_under(path, folders["TextualInversion"]):
+            titles.append("textual_inversion/" + stem)
+        lora_folders = {folders[t] for t in ("LORA", "LyCORIS", "LoCon", "LoHa", "DoRA")}
+        if ext.lower() != ".safetensors" and any(_is_under(path, f) for f in lora_folders):
+            titles.append("lora/" + stem)
+    except ValueError:
+        # Paths on different drives
+        pass
+    return titles
+
+
+def lookup(file_path):
+    """SHA256 of a model from the WebUI's hash cache, using the WebUI's own mtime rules."""
+    if webui_hashes is None:
+        return None
+    for title in get_cache_titles(file_path):
+        try:
+            cached = webui_hashes.sha256_from_cache(file_path, title)
+        except Exception:
+            cached = None
+        if cached:
+            return cached.lower()
+    return None
+
+
+def store_many(entries):
+    """Write {path: sha256} back into the WebUI's hash cache, so both sides share one cache."""
+    if webui_cache is None or not entries:
+        return
+    try:
+        hashes = webui_cache.cache("hashes")
+        changed = False
+        for file_path, sha256 in entries.items():
+            titles = get_cache_titles(file_path)
+            if not titles:
+                continue
+            mtime = os.path.getmtime(file_path)
+            for title in titles:
+                hashes[title] = {"mtime": mtime, "sha256": sha256}
+            changed = True
+        if changed:
+            webui_cache.dump_cache()
+    except Exception as e:
+        print(f"Failed to update the WebUI hash cache: {e}")
+
+
+def store(file_path, sha256):
+    store_many({file_path: sha256})
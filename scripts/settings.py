@@ -1,6 +1,7 @@
 import gradio as gr
 from modules import shared
 from modules.options import OptionDiv
+from scripts.backend.library_watcher import apply_watch_setting
 
 
 def on_ui_settings():
@@ -65,6 +66,78 @@ def on_ui_settings():
             {"interactive": True},
             section=section,
         ).info("Use the model's title (from metadata) as the card title instead of the filename. Note: Search will still use the filenames. Requires a restart."),
+        "sep04": OptionDiv(),
+        "civitai_download_connections": shared.OptionInfo(
+            4,
+            "Connections per download",
+            gr.Slider,
+            {"minimum": 1, "maximum": 16, "step": 1},
+            section=section,
+        ).info("Large files are split into byte ranges downloaded in parallel when the server supports it. 1 disables segmented downloads."),
+        "civitai_max_concurrent_downloads": shared.OptionInfo(
+            2,
+            "Concurrent downloads",
+            gr.Slider,
+            {"minimum": 1, "maximum": 8, "step": 1},
+            section=section,
+        ).info("How many downloads from the queue may run at the same time."),
+        "civitai_max_concurrent_missing_info_checks": shared.OptionInfo(
+            1,
+            "Concurrent missing-info checks",
+            gr.Slider,
+            {"minimum": 1, "maximum": 4, "step": 1},
+            section=section,
+        ).info("How many missing-info checks may run at the same time. They run side by side with update checks."),
+        "civitai_max_concurrent_update_checks": shared.OptionInfo(
+            1,
+            "Concurrent update checks",
+            gr.Slider,
+            {"minimum": 1, "maximum": 4, "step": 1},
+            section=section,
+        ).info("How many update checks may run at the same time. They run side by side with missing-info checks."),
+        "civitai_download_speed_limit": shared.OptionInfo(
+            0,
+            "Total download speed limit (MB/s)",
+            gr.Slider,
+            {"minimum": 0, "maximum": 500, "step": 0.5},
+            section=section,
+        ).info("Shared by all running downloads, 0 means unlimited. Keeps bandwidth free for everything else on this machine."),
+        "civitai_job_speed_limit": shared.OptionInfo(
+            0,
+            "Speed limit per download (MB/s)",
+            gr.Slider,
+            {"minimum": 0, "maximum": 500, "step": 0.5},
+            section=section,
+        ).info("Applies to each download on its own, 0 means unlimited."),
+        "civitai_low_io_priority": shared.OptionInfo(
+            False,
+            "Low I/O priority for downloads and hashing",
+            gr.Checkbox,
+            {"interactive": True},
+            section=section,
+        ).info("Downloads and hashing yield the disk to image generation and model loading (Linux), and don't push the loaded models out of the page cache."),
+        "civitai_api_cache_minutes": shared.OptionInfo(
+            10,
+            "Reuse Civitai API responses for (minutes)",
+            gr.Slider,
+            {"minimum": 0, "maximum": 1440, "step": 1},
+            section=section,
+        ).info("Model info fetched within this time is reused without asking Civitai. Older responses are revalidated, which costs almost nothing when the model didn't change. 0 always revalidates."),
+        "civitai_hedged_requests": shared.OptionInfo(
+            False,
+            "Hedge Civitai API requests across domains",
+            gr.Checkbox,
+            {"interactive": True},
+            section=section,
+        ).info("When a domain answers slower than usual, also ask the other domain and use whichever answers first. Cuts waiting when one domain is degraded, at the cost of some extra requests."),
+        "civitai_watch_library": shared.OptionInfo(
+            False,
+            "Watch model folders for changes",
+            gr.Checkbox,
+            {"interactive": True},
+            onchange=lambda: apply_watch_setting(shared.opts.civitai_watch_library),
+            section=section,
+        ).info("Keeps an index of models and their info files up to date in the background, so the info tools don't have to scan the folders. Uses the watchdog package if installed, otherwise checks every minute."),
     }
     for opt_name, opt_info in options.items():
         # Ensure OptionDiv has a section attribute set
@@ -1,18 +1,17 @@
 import modules.scripts as scripts
 import gradio as gr
 import os
-import re
-import requests
 import time
 import json
-from urllib.parse import urlparse, parse_qs, urlunparse
+from urllib.parse import urlparse
 from modules import script_callbacks, shared as _shared
-from scripts.backend.utils import get_model_folders, get_civitai_api_key, get_civitai_model_info, save_preview_and_metadata
-from scripts.backend import metadata, delete_model
+from scripts.backend.utils import get_civitai_api_key, get_civitai_model_info, parse_civitai_model_and_version_id
+from scripts.backend.download_queue import download_queue, QUEUED, RUNNING, DONE, CANCELLED, PAUSED
+from scripts.backend import metadata, delete_model, library_watcher, api, api_cache, hash_index
 from scripts.settings import on_ui_settings
-from scripts.backend.check_missing_info import check_missing_info
-from scripts.backend.check_model_updates import check_model_updates
-from scripts.backend.process_control import is_running, get_type, cancel_process
+from scripts.backend.process_control import job_registry
+from scripts.backend.scan_jobs import start_scan_job, run_scan, busy_message
+from scripts.backend.results import get_latest_results, CATEGORIES
 
 
 def get_package_version():
@@ -26,31 +25,6 @@ def get_package_version():
 
 VERSION = get_package_version()
 
-def parse_civitai_model_and_version_id(input_str):
-    if input_str.strip().isdigit():
-        return input_str.strip(), None
-    try:
-        parsed = urlparse(input_str)
-        if parsed.netloc in [
-            "civitai.com",
-            "www.civitai.com",
-            "civitai.red",
-            "www.civitai.red",
-        ]:
-            match = re.match(r"^/models/(\d+)", parsed.path)
-            model_id = match.group(1) if match else None
-            qs = parse_qs(parsed.query)
-            model_version_id = qs.get("modelVersionId", [None])[0]
-            return model_id, model_version_id
-    except Exception:
-        pass
-    match = re.search(r"civitai\.(?:com|red)/models/(\d+)", input_str)
-    model_id = match.group(1) if match else None
-    match_version = re.search(r"modelVersionId=(\d+)", input_str)
-    model_version_id = match_version.group(1) if match_version else None
-    return model_id, model_version_id
-
-
 def get_civitai_first_image_url_from_model_info(model_info, model_version_id=None):
     """
     Returns the first image URL from the specified model version that has a supported image extension,
@@ -123,246 +97,101 @@ def get_first_valid_preview_image(model_info, preview_url=None):
                 return url
     return None
 
-def robust_get(url, headers=None, stream=False, timeout=15, max_retries=5):
-    last_exc = None
-    for attempt in range(1, max_retries + 1):
-        try:
-            resp = requests.get(url, headers=headers, stream=stream, timeout=timeout)
-            resp.raise_for_status()
-            return resp
-        except Exception as e:
-            print(f"Attempt {attempt} failed for {url}: {e}")
-            last_exc = e
-            time.sleep(2)  # Wait before retrying
-    raise last_exc
+# How often the UI reads the progress of a running download
+UI_POLL_INTERVAL = 0.5
 
 
-# Global dictionary to track cancellation flags per model_id
-DOWNLOAD_CANCEL_FLAGS = {}
+def download_progress_label(downloaded, total):
+    if not total:
+        return ""
+    return (
+        f"Downloading: {downloaded//1024}KB/{total//1024}KB "
+        f"({downloaded/total*100:.1f}%)"
+    )
+
 
+def job_progress_label(job):
+    if job.state == QUEUED:
+        ahead = download_queue.queue_position(job)
+        return f"Queued ({ahead} ahead)" if ahead else "Queued"
+    if job.state == RUNNING:
+        return download_progress_label(job.downloaded, job.total) or "Starting..."
+    labels = {DONE: "Done", CANCELLED: "Cancelled", PAUSED: "Paused"}
+    return labels.get(job.state, "Error")
 
-def cancel_download(model_id):
-    """Set the cancellation flag for a given model_id."""
-    DOWNLOAD_CANCEL_FLAGS[model_id] = True
+
+def watch_download_job(job, progress=None):
+    """
+    Show the progress of a download running in the queue's background workers. Only reads the
+    job's fields at a fixed rate, so the download doesn't depend on this generator being consumed.
+    """
+    last = None
+    while True:
+        # A paused job only moves again when resumed from the queue, stop watching it
+        active = job.is_pending()
+        current = (job_progress_label(job), job.message)
+        if progress is not None and job.state == RUNNING and job.total:
+            progress(job.progress())
+        if current != last:
+            yield gr.Label.update(value=current[0]), gr.Textbox.update(value=current[1])
+            last = current
+        if not active:
+            return
+        time.sleep(UI_POLL_INTERVAL)
 
 
 def download_civitai_model_with_progress(
     model_id, model_version_id=None, progress=gr.Progress(), selected_preview_url=None
 ):
     """
-    The cancel button should set DOWNLOAD_CANCEL_FLAGS[model_id] = True.
+    Hands the download to the download queue's background workers, ahead of other queued jobs,
+    and follows its progress. Reloading the page or closing the tab doesn't stop the download;
+    clicking Download again for the same model shows its progress again.
     """
     # Clear output at the start of a new download
     yield gr.Label.update(value="Starting..."), gr.Textbox.update(value="")
-    api_key = get_civitai_api_key()
-    # Reset cancellation flag at the start
-    DOWNLOAD_CANCEL_FLAGS[model_id] = False
-
-    try:
-        data = get_civitai_model_info(model_id, api_key=api_key)
-    except Exception as e:
-        # Clean up flag on error
-        DOWNLOAD_CANCEL_FLAGS.pop(model_id, None)
-        yield gr.Label.update(value="Error"), gr.Textbox.update(
-            value=f"Error: {str(e)}"
-        )
-        return
-
-    model_versions = data.get("modelVersions", [])
-    version = None
-    if model_version_id:
-        for v in model_versions:
-            if str(v.get("id")) == str(model_version_id):
-                version = v
-                break
-        if not version:
-            DOWNLOAD_CANCEL_FLAGS.pop(model_id, None)
-            yield (
-                gr.Label.update(value="Error"),
-                gr.Textbox.update(
-                    value=f"Model version ID {model_version_id} not found for model {model_id}."
-                ),
-            )
-            return
-    else:
-        if model_versions:
-            version = model_versions[0]
-        else:
-            DOWNLOAD_CANCEL_FLAGS.pop(model_id, None)
-            yield gr.Label.update(value="Error"), gr.Textbox.update(
-                value="No versions found for this model."
-            )
-            return
-
-    model_type = data.get("type", "Checkpoint")
-    valid_extensions = {".safetensors", ".pth", ".ckpt"}
-    model_files = [
-        f for f in version["files"]
-        if any(f["name"].lower().endswith(ext) for ext in valid_extensions)
-    ]
-
-    if not model_files:
-        DOWNLOAD_CANCEL_FLAGS.pop(model_id, None)
-        yield gr.Label.update(value="Error"), gr.Textbox.update(
-            value="No valid model file found for this version."
-        )
-        return
-
-    file_info = model_files[0]
-    download_url = file_info["downloadUrl"]
-    filename = file_info["name"]
-
-    # Sanitize filename: keep only a-z, A-Z, 0-9, - and _
-    def sanitize_filename(filename):
-        base, ext = os.path.splitext(filename)
-        base = re.sub(r"\s+", "-", base)
-        base = re.sub(r"[^a-zA-Z0-9\-_]", "", base)
-        return base + ext
-
-    filename = sanitize_filename(filename)
-
-    MODEL_FOLDERS = get_model_folders()
-    folder = MODEL_FOLDERS.get(model_type, os.path.join("models", "Stable-diffusion"))
-    os.makedirs(folder, exist_ok=True)
-    dest_path = os.path.join(folder, filename)
-
-    if os.path.exists(dest_path):
-        msg = f"Model already exists: {dest_path}"
-        print(msg)
-        # Still save metadata and preview if missing
-        # Use selected preview URL if provided, otherwise fall back to first image
-        preview_url = selected_preview_url
-        if not preview_url and "images" in version and version["images"]:
-            preview_url = version["images"][0]["url"]
-        save_preview_and_metadata(folder, filename, data, preview_url, version)
-        DOWNLOAD_CANCEL_FLAGS.pop(model_id, None)
-        yield gr.Label.update(value=msg), gr.Textbox.update(value=msg)
-        return
-
-    headers = {}
-    if api_key:
-        headers["Authorization"] = f"Bearer {api_key}"
-
-    # Always use civitai.com for file downloads, seems civitai.red does not support downloads atm.
-    try:
-        parsed_dl = urlparse(download_url)
-        host_dl = parsed_dl.netloc or ""
-        if "civitai.red" in host_dl:
-            host_dl = host_dl.replace("civitai.red", "civitai.com")
-            download_url = urlunparse(parsed_dl._replace(netloc=host_dl))
-            print(f"Normalizing download URL to civitai.com: {download_url}")
-    except Exception:
-        pass
-
-    try:
-        r = None
-        try:
-            r = robust_get(download_url, headers=headers, stream=True)
-        except Exception as e:
-            raise
-
-        with r as r:
-            r.raise_for_status()
-            total = int(r.headers.get("content-length", 0))
-            chunk_size = 8192 * 4  # 32KB
-            update_interval = 1024 * 1024 * 10  # 10MB
-
-            print(f"\nDownloading {filename} ({model_type}) from {download_url}")
-            print(f"Total size: {total // 1024 // 1024}MB")
-
-            with open(dest_path, "wb") as f:
-                downloaded = 0
-                last_update = 0
-                last_progress = 0
-                start_time = time.time()
-
-                while True:
-                    chunk = r.raw.read(chunk_size)
-                    if not chunk:
-                        break
-
-                    # Check for cancellation frequently
-                    if DOWNLOAD_CANCEL_FLAGS.get(model_id, False):
-                        f.close()
-                        try:
-                            os.remove(dest_path)
-                        except Exception as cleanup_err:
-                            print(f"Failed to remove partial file: {cleanup_err}")
-                        DOWNLOAD_CANCEL_FLAGS.pop(model_id, None)
-                        yield (
-                            gr.Label.update(value="Cancelled"),
-                            gr.Textbox.update(
-                                value=f"Download cancelled and partial files deleted for: {filename}"
-                            ),
-                        )
-                        return
-
-                    f.write(chunk)
-                    downloaded += len(chunk)
-
-                    # Terminal progress bar
-                    now = time.time()
-                    if now - last_update > 0.5 or downloaded == total:
-                        mb_downloaded = downloaded / 1024 / 1024
-                        mb_total = total / 1024 / 1024 if total else 0
-                        percent = (downloaded / total * 100) if total else 0
-                        elapsed = now - start_time
-                        speed = mb_downloaded / elapsed if elapsed > 0 else 0
-                        eta = (
-                            ((total - downloaded) / (speed * 1024 * 1024))
-                            if speed > 0 and total
-                            else 0
-                        )
-                        bar_len = 30
-                        filled_len = int(bar_len * downloaded // total) if total else 0
-                        bar = "=" * filled_len + "-" * (bar_len - filled_len)
-                        print(
-                            f"\r[{bar}] {mb_downloaded:.1f}/{mb_total:.1f}MB "
-                            f"({percent:.1f}%) | {speed:.2f}MB/s | ETA: {eta:.1f}s",
-                            end="",
-                            flush=True,
-                        )
-                        last_update = now
-
-                    # Gradio progress
-                    progress_str = "Downloading..."
-                    if (
-                        downloaded - last_progress > update_interval
-                        or downloaded == total
-                    ):
-                        progress((downloaded / total) if total else 0)
-                        yield (
-                            gr.Label.update(
-                                value=(
-                                    f"Downloading: {downloaded//1024}KB/{total//1024 if total else '?'}KB "
-                                    f"({downloaded/total*100:.1f}%)"
-                                    if total
-                                    else ""
-                                )
-                            ),
-                            gr.Textbox.update(value=progress_str),
-                        )
-                        last_progress = downloaded
-
-                print()  # Newline after terminal progress
-            print(f"\nDownloaded to {dest_path}")
-
-        # After download, save preview and metadata
-        # Use selected preview URL if provided, otherwise fall back to first image
-        preview_url = selected_preview_url
-        if not preview_url and "images" in version and version["images"]:
-            preview_url = version["images"][0]["url"]
-        save_preview_and_metadata(folder, filename, data, preview_url, version)
-        DOWNLOAD_CANCEL_FLAGS.pop(model_id, None)
-        yield gr.Label.update(value="Done"), gr.Textbox.update(
-            value=f"Downloaded Civitai {model_type} model to: {dest_path}"
-        )
-        time.sleep(0.2)
-    except Exception as e:
-        DOWNLOAD_CANCEL_FLAGS.pop(model_id, None)
-        yield gr.Label.update(value="Error"), gr.Textbox.update(
-            value=f"Error downloading from Civitai: {str(e)}"
-        )
+    job = download_queue.find_duplicate(model_id, model_version_id)
+    if job is None:
+        job = download_queue.add(model_id, model_version_id, selected_preview_url, front=True)
+    yield from watch_download_job(job, progress)
+
+
+QUEUE_HEADERS = ["ID", "Model", "File", "State", "Progress", "Speed", "Message"]
+
+
+def get_queue_rows():
+    rows = []
+    for job in list(download_queue.jobs):
+        progress = f"{job.progress() * 100:.1f}%" if job.total else ""
+        speed = f"{job.speed() / 1024 / 1024:.2f}MB/s" if job.speed() else ""
+        rows.append([
+            job.id,
+            job.model_name or f"Model {job.model_id}",
+            job.filename or "",
+            job.state,
+            progress,
+            speed,
+            job.message,
+        ])
+    return rows or [["", "", "", "", "", "", "Queue is empty."]]
+
+
+RESULTS_HEADERS = ["Result", "File", "Message"]
+RESULTS_ALL = "All"
+
+
+def get_results_page(category, query, page):
+    """One page of the latest check's results for the results table, and a line describing it."""
+    results = get_latest_results()
+    if results is None:
+        return [["", "", "No check has run yet."]], ""
+    category = None if category in (None, RESULTS_ALL) else category.lower()
+    rows, matches, pages = results.page(category, query, page)
+    page = min(max(1, int(page or 1)), pages)
+    info = f"Page {page} of {pages}, {matches} result(s). {results.summary()}"
+    if results.log_path:
+        info += f"\n\nFull log: `{results.log_path}`"
+    return [list(row) for row in rows] or [["", "", "No matching results."]], info
 
 
 def download_model(model_state, preview_urls_state, preview_selection, progress=gr.Progress()):
@@ -486,6 +315,48 @@ def on_ui_tabs():
                 )
                 info = gr.Textbox(label="Model Info", interactive=False, lines=6)
 
+        with gr.Accordion("Download Queue", open=False):
+            with gr.Row():
+                with gr.Column(scale=3):
+                    queue_urls = gr.Textbox(
+                        label="Civitai Model URLs or IDs",
+                        placeholder="One model URL or ID per line",
+                        lines=4,
+                    )
+                with gr.Column(scale=1):
+                    queue_add_btn = gr.Button("Add to queue", variant="primary")
+                    queue_refresh_btn = gr.Button("Refresh", variant="secondary")
+                    queue_clear_btn = gr.Button("Clear finished", variant="secondary")
+            with gr.Row():
+                queue_job_id = gr.Number(label="Job ID", precision=0, value=None)
+                queue_pause_btn = gr.Button("Pause", variant="secondary")
+                queue_resume_btn = gr.Button("Resume / Retry", variant="secondary")
+                queue_cancel_btn = gr.Button("Cancel job", variant="stop")
+            queue_status = gr.Markdown()
+            queue_table = gr.Dataframe(
+                headers=QUEUE_HEADERS,
+                value=get_queue_rows(),
+                interactive=False,
+                wrap=True,
+            )
+
+        with gr.Accordion("Check Results", open=False):
+            with gr.Row():
+                results_category = gr.Dropdown(
+                    label="Show",
+                    choices=[RESULTS_ALL] + [c.capitalize() for c in CATEGORIES],
+                    value=RESULTS_ALL,
+                )
+                results_query = gr.Textbox(label="Filter", placeholder="File name or message")
+                results_page = gr.Number(label="Page", precision=0, value=1)
+                results_refresh_btn = gr.Button("Refresh", variant="secondary")
+            results_info = gr.Markdown()
+            results_table = gr.Dataframe(
+                headers=RESULTS_HEADERS,
+                interactive=False,
+                wrap=True,
+            )
+
         model_state = gr.State(value=None)
         preview_urls_state = gr.State(value=None)  # Store (preview1_url, preview2_url)
         gr.Markdown(
@@ -546,51 +417,113 @@ def on_ui_tabs():
         def cancel_download(state):
             cancelled = False
             # Cancel model download if running
-            if state and state[0] and not DOWNLOAD_CANCEL_FLAGS.get(state[0], False):
-                DOWNLOAD_CANCEL_FLAGS[state[0]] = True
+            job = download_queue.find_active(state[0], state[1]) if state and state[0] else None
+            if job and download_queue.cancel(job.id):
+                cancelled = True
+            # Cancel the checks started from the UI, checks started through the API keep running
+            if job_registry.cancel_all(owner="ui"):
                 cancelled = True
-            # Cancel any backend process if running
-            try:
-                if is_running():
-                    cancel_process()
-                    cancelled = True
-            except Exception:
-                pass
             if cancelled:
                 return gr.Label.update(value=""), "Cancelling..."
             else:
                 return gr.Label.update(value=""), "Nothing to cancel."
 
+        def add_to_queue(urls):
+            added = []
+            errors = []
+            for line in (urls or "").splitlines():
+                if not line.strip():
+                    continue
+                model_id, model_version_id = parse_civitai_model_and_version_id(line)
+                if not model_id:
+                    errors.append(f"Could not parse model ID from: {line.strip()}")
+                    continue
+                job = download_queue.add(model_id, model_version_id)
+                added.append(f"#{job.id}")
+            msg = f"Queued {len(added)} download(s): {', '.join(added)}" if added else "Nothing added."
+            return "\n\n".join([msg] + errors), ""
+
+        def queue_action(action, job_id):
+            if job_id is None:
+                return "Enter a job ID first."
+            job_id = int(job_id)
+            handlers = {
+                "pause": download_queue.pause,
+                "resume": download_queue.resume,
+                "cancel": download_queue.cancel,
+            }
+            if handlers[action](job_id):
+                return f"Job #{job_id}: {action} requested."
+            return f"Job #{job_id}: can't {action} in its current state."
+
+        def watch_queue():
+            # Poll the queue state for as long as something is queued or running
+            while True:
+                yield get_queue_rows()
+                if not download_queue.has_pending_jobs():
+                    return
+                time.sleep(1)
+
+        def clear_finished():
+            download_queue.clear_finished()
+            return get_queue_rows()
+
         # --- Button bindings ---
+        queue_add_btn.click(
+            fn=add_to_queue,
+            inputs=[queue_urls],
+            outputs=[queue_status, queue_urls],
+        ).then(fn=watch_queue, inputs=[], outputs=[queue_table])
+        queue_refresh_btn.click(fn=watch_queue, inputs=[], outputs=[queue_table])
+        queue_clear_btn.click(fn=clear_finished, inputs=[], outputs=[queue_table])
+        for btn, action in (
+            (queue_pause_btn, "pause"),
+            (queue_resume_btn, "resume"),
+            (queue_cancel_btn, "cancel"),
+        ):
+            btn.click(
+                fn=lambda job_id, action=action: queue_action(action, job_id),
+                inputs=[queue_job_id],
+                outputs=[queue_status],
+            ).then(fn=watch_queue, inputs=[], outputs=[queue_table])
         check_btn.click(
             fn=check_and_update,
             inputs=[model_url],
             outputs=[preview1, preview2, info, model_state, preview_urls_state, download_btn],
         )
-        def check_missing_info_or_cancel():
-            if is_running():
-                cancel_process()
-                yield "Stopping current process..."
+        def run_check_or_cancel(scan_type):
+            # Pressing the button of a running check stops it, the other kind of check isn't affected
+            if job_registry.cancel_all(scan_type, owner="ui"):
+                yield "Stopping current check..."
+                return
+            job = start_scan_job(scan_type, owner="ui")
+            if job is None:
+                yield busy_message(scan_type)
                 return
-            yield from check_missing_info()
+            yield from run_scan(scan_type, job)
+
+        def check_missing_info_or_cancel():
+            yield from run_check_or_cancel("missing_info")
 
         def check_model_updates_or_cancel():
-            if is_running():
-                cancel_process()
-                yield "Stopping current process..."
-                return
-            yield from check_model_updates()
+            yield from run_check_or_cancel("updates")
 
+        results_inputs = [results_category, results_query, results_page]
+        results_outputs = [results_table, results_info]
         check_missing_btn.click(
             fn=check_missing_info_or_cancel,
             inputs=[],
             outputs=[output],
-        )
+        ).then(fn=get_results_page, inputs=results_inputs, outputs=results_outputs)
         check_updates_btn.click(
             fn=check_model_updates_or_cancel,
             inputs=[],
             outputs=[output],
-        )
+        ).then(fn=get_results_page, inputs=results_inputs, outputs=results_outputs)
+        results_refresh_btn.click(fn=get_results_page, inputs=results_inputs, outputs=results_outputs)
+        results_query.submit(fn=get_results_page, inputs=results_inputs, outputs=results_outputs)
+        for component in (results_category, results_page):
+            component.change(fn=get_results_page, inputs=results_inputs, outputs=results_outputs)
         download_btn.click(
             fn=download_model,
             inputs=[model_state, preview_urls_state, preview_selection],
@@ -609,3 +542,7 @@ script_callbacks.on_ui_tabs(on_ui_tabs)
 script_callbacks.on_ui_settings(on_ui_settings)
 script_callbacks.on_app_started(metadata.on_app_started)
 script_callbacks.on_app_started(delete_model.on_app_started)
+script_callbacks.on_app_started(library_watcher.on_app_started)
+script_callbacks.on_app_started(api.on_app_started)
+script_callbacks.on_app_started(api_cache.on_app_started)
+script_callbacks.on_app_started(hash_index.on_app_started)